@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# benchmark.py
+# Benchmark suite of the Quarto engine, protocol and full games.
+
+# Every benchmark runs a fixed amount of work on positions drawn from
+# seeded random games, so that two runs measure the same thing, sized to
+# take most of a second so that timer and scheduling noise stay small. Each
+# one is repeated and the median and best throughputs are kept. Results are
+# written as JSON (by default in benchmarks/, named after the current
+# commit) and can be compared with an earlier result file to spot the
+# regressions: medians are compared, with a tolerance widened by the spread
+# of the runs of both files.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from lib import game
+from lib import mcts
+from lib import search
+from lib import transposition
+from quarto import QuartoClient, QuartoServer, QuartoState
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+DEFAULT_SEED = 2018
+DEFAULT_REPEAT = 5
+# Minimal relative slowdown of the median reported as a regression by --compare
+DEFAULT_TOLERANCE = 0.10
+
+
+def randomgames(count, seed):
+    '''Return the wire moves of 'count' random games, from the first
+    player's point of view.'''
+    rnd = random.Random(seed)
+    games = []
+    for _ in range(count):
+        state = QuartoState()
+        moves = []
+        while state.winner() == -1:
+            pos, nextPiece = rnd.choice(list(state.legalmoves()))
+            move = {}
+            if pos is not None:
+                move['pos'] = pos
+            if nextPiece is not None:
+                move['nextPiece'] = nextPiece
+            state.applymove(move)
+            state.nextPlayer()
+            moves.append(move)
+        games.append(moves)
+    return games
+
+
+def positions(games, minply=0):
+    '''Return the states reached during 'games', from ply 'minply' on,
+    excluding the finished ones.'''
+    states = []
+    for moves in games:
+        state = QuartoState()
+        for ply, move in enumerate(moves):
+            if ply >= minply:
+                states.append(QuartoState.parse(str(state)))
+            state.applymove(move)
+            state.nextPlayer()
+    return states
+
+
+def _applymove(games, rounds):
+    count = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for moves in games:
+            state = QuartoState()
+            for move in moves:
+                state.applymove(move)
+                state.winner()
+                state.nextPlayer()
+            count += len(moves)
+    return count, time.perf_counter() - start
+
+
+def _winner(states, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for state in states:
+            state.winner()
+    return rounds * len(states), time.perf_counter() - start
+
+
+def _roundtrip(states, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for state in states:
+            # A parsed state has no cached text, str() serializes it again
+            QuartoState.parse(str(QuartoState.parse(str(state))))
+    return 2 * rounds * len(states), time.perf_counter() - start
+
+
+def _movegen(boards, rounds):
+    count = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for board in boards:
+            for _ in board.moves():
+                count += 1
+    return count, time.perf_counter() - start
+
+
+def _alphabeta(boards, depth):
+    searcher = search.Searcher(timelimit=float('inf'), maxdepth=depth, table=transposition.TranspositionTable(1))
+    nodes = 0
+    start = time.perf_counter()
+    for board in boards:
+        searcher.table.clear()
+        nodes += searcher.search(board).nodes
+    return nodes, time.perf_counter() - start
+
+
+def _playouts(boards, seed, rounds):
+    rnd = random.Random(seed)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for board in boards:
+            mcts.playout(board, rnd)
+    return rounds * len(boards), time.perf_counter() - start
+
+
+def _games(count):
+    # Loopback games between two heuristic clients through a lobby
+    lobby = game.GameLobby(lambda: QuartoServer(), host='127.0.0.1', port=0, games=count)
+    thread = threading.Thread(target=lobby.run, daemon=True)
+    thread.start()
+    if not lobby.listening.wait(10):
+        raise RuntimeError('the lobby did not start')
+    start = time.perf_counter()
+    for _ in range(count):
+        clients = [
+            threading.Thread(target=QuartoClient, args=('bench{}'.format(j), lobby.address))
+            for j in range(2)
+        ]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+    thread.join()
+    return lobby.finished, time.perf_counter() - start
+
+
+def benchmarks(scale, seed):
+    '''Return the (name, unit, function) of the benchmarks, with work
+    multiplied by 'scale'. At scale 1, a run takes from half a second to a
+    second on a desktop machine.'''
+    games = randomgames(max(1, int(200 * scale)), seed)
+    states = positions(games)
+    boards = [state.board for state in states]
+    middle = [state.board for state in positions(games[:max(1, int(20 * scale))], minply=6)]
+    return [
+        ('applymove', 'moves/s', lambda: _applymove(games, 24)),
+        ('winner', 'calls/s', lambda: _winner(states, 600)),
+        ('parse_str_roundtrip', 'roundtrips/s', lambda: _roundtrip(states, 2)),
+        ('movegen', 'moves/s', lambda: _movegen(boards, 2)),
+        ('alphabeta_depth3', 'nodes/s', lambda: _alphabeta(middle, 3)),
+        ('mcts_playouts', 'playouts/s', lambda: _playouts(middle, seed, 120)),
+        ('loopback_games', 'games/s', lambda: _games(max(1, int(200 * scale)))),
+    ]
+
+
+def run(names=None, scale=1.0, repeat=DEFAULT_REPEAT, seed=DEFAULT_SEED):
+    '''Run the benchmarks ('names' of them, all if None).
+
+    Pre: -
+    Post: The returned dictionary maps each benchmark name to its result:
+          'best' and 'median' throughputs in 'unit', 'count' operations
+          per run, the 'times' of the runs in seconds and their 'spread'
+          (see _spread()).
+    '''
+    results = {}
+    for name, unit, function in benchmarks(scale, seed):
+        if names and name not in names:
+            continue
+        times = []
+        for _ in range(repeat):
+            count, elapsed = function()
+            times.append(elapsed)
+        results[name] = {
+            'unit': unit,
+            'count': count,
+            'best': count / min(times),
+            'median': count / statistics.median(times),
+            'times': times,
+            'spread': _spread(times)
+        }
+        print(' {:<20} {:>14,.0f} {:<12} (best {:,.0f}, spread {:.1%})'.format(
+            name, results[name]['median'], unit, results[name]['best'], results[name]['spread']
+        ))
+    return results
+
+
+def _spread(times):
+    # Relative range of the run times, the noise of a measure
+    return (max(times) - min(times)) / statistics.median(times)
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results, tolerance=DEFAULT_TOLERANCE):
+    '''Print the median results against 'baseline', return the names of
+    the benchmarks that got slower by more than their threshold: the
+    spread of the runs of both files, or 'tolerance' if larger.'''
+    game._printsection('Comparison with {}'.format(baseline['commit'] or 'baseline'))
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]
+        if old['count'] != result['count']:
+            print(' {:<20} not compared, the amount of work differs'.format(name))
+            continue
+        before = old['median']
+        ratio = result['median'] / before if before else float('inf')
+        threshold = max(tolerance, _spread(old['times']) + result['spread'])
+        flag = ''
+        if ratio < 1 - threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(' {:<20} {:>14,.0f} -> {:>14,.0f} {:<12} {:+7.1%} (threshold {:.1%}){}'.format(
+            name, before, result['median'], result['unit'], ratio - 1, -threshold, flag
+        ))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Quarto benchmarks')
+    parser.add_argument('names', help='benchmarks to run (default: all)', nargs='*')
+    parser.add_argument('--scale', help='work multiplier, below 1 for a quick run (default: 1.0)', type=float, default=1.0)
+    parser.add_argument('--repeat', help='runs of each benchmark (default: {})'.format(DEFAULT_REPEAT), type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--seed', help='seed of the random positions (default: {})'.format(DEFAULT_SEED), type=int, default=DEFAULT_SEED)
+    parser.add_argument('--output', help='JSON result file (default: benchmarks/COMMIT.json)', default=None)
+    parser.add_argument('--compare', help='earlier JSON result file to compare with', default=None)
+    parser.add_argument('--tolerance', help='minimal slowdown of the median reported as a regression, widened by the spread of the runs (default: {})'.format(DEFAULT_TOLERANCE), type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    commit = _commit()
+    game._printsection('Benchmarks')
+    results = run(args.names, args.scale, args.repeat, args.seed)
+    report = {
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'scale': args.scale, 'repeat': args.repeat, 'seed': args.seed},
+        'results': results
+    }
+    output = args.output
+    if output is None:
+        output = os.path.join(RESULTS_DIR, '{}.json'.format(commit or 'results'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+        file.write('\n')
+    print(' Results written to {}'.format(output))
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline['settings'] != report['settings']:
+            print(' Warning: the baseline was run with other settings ({}).'.format(baseline['settings']))
+        if compare(baseline, results, args.tolerance):
+            sys.exit(1)
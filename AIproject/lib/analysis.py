@@ -0,0 +1,111 @@
+# analysis.py
+# Aggregate statistics over a game log (requires NumPy).
+
+# The log is mapped in memory (see gamelog.load()) and processed in chunks
+# of records, so that the memory used does not depend on the number of
+# games. Within a chunk, the boards of all the games are replayed together,
+# one placement at a time, on an (N, 10) array of the packed line counters
+# of bitboard.Board.
+
+import numpy as np
+
+from . import bitboard
+from . import gamelog
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+ALL_PIECES = (1 << bitboard.NB_PIECES) - 1
+# (16, 10) lines through each square and line counter increments of the pieces
+_SQUARE_LINES = np.array(
+    [[sq in line for line in bitboard.LINES] for sq in range(bitboard.NB_SQUARES)],
+    dtype=np.int64
+)
+_PIECE_COUNTS = np.array(bitboard.PIECE_COUNTS, dtype=np.int64)
+
+
+def _outcomes(chunk):
+    # (N,) flags of the games won by the first player, by the second one
+    # and drawn
+    result = chunk['result']
+    draw = result == gamelog.DRAW
+    firstwin = ~draw & (result == chunk['first'])
+    return firstwin, ~draw & ~firstwin, draw
+
+
+def _bykey(stats, name, keys, firstwin, secondwin):
+    # Count the games and the wins of each player by value of 'keys'
+    valid = keys != gamelog.NONE
+    keys = keys[valid].astype(np.intp)
+    table = stats[name]
+    table[0] += np.bincount(keys, minlength=bitboard.NB_SQUARES)
+    table[1] += np.bincount(keys, weights=firstwin[valid], minlength=bitboard.NB_SQUARES).astype(np.int64)
+    table[2] += np.bincount(keys, weights=secondwin[valid], minlength=bitboard.NB_SQUARES).astype(np.int64)
+
+
+def _safety(stats, chunk):
+    # Replay the games of the chunk and count, after each placement, the
+    # positions where no piece can be given without allowing a quarto
+    placements = chunk['placements'].astype(np.intp)
+    given = chunk['given'].astype(np.intp)
+    length = (placements != gamelog.NONE).sum(axis=1)
+    count = len(chunk)
+    counters = np.zeros((count, len(bitboard.LINES)), dtype=np.int64)
+    placed = np.zeros(count, dtype=np.int64)
+    for ply in range(1, bitboard.NB_SQUARES):
+        # Games where the placement of this ply was played
+        games = np.flatnonzero(length >= ply)
+        if len(games) == 0:
+            break
+        pieces = given[games, ply - 1]
+        counters[games] += _SQUARE_LINES[placements[games, ply - 1]] * _PIECE_COUNTS[pieces][:, None]
+        placed[games] |= np.left_shift(1, pieces)
+        lines = counters[games]
+        # Games going on, where a piece has to be given
+        ongoing = ~((lines & bitboard.FOUR_MASK) != 0).any(axis=1)
+        games, lines = games[ongoing], lines[ongoing]
+        # Attribute values shared by the three pieces of a line (see
+        # Board._updatethreat), as the low bits of the fields equal to 3
+        three = (lines & 7) + (lines >> bitboard.FIELD_BITS & 7) == 3
+        shared = np.bitwise_or.reduce(np.where(three, lines & (lines >> 1) & bitboard.LOW_MASK, 0), axis=1)
+        unsafe = np.zeros(len(games), dtype=np.int64)
+        for k, pieces in enumerate(bitboard.VALUE_PIECES):
+            unsafe |= -(shared >> bitboard.FIELD_BITS * k & 1) & pieces
+        stats['positions'][ply] += len(games)
+        stats['unsafe'][ply] += int(np.count_nonzero(ALL_PIECES & ~placed[games] & ~unsafe == 0))
+
+
+def analyze(path, chunksize=DEFAULT_CHUNK_SIZE):
+    '''Compute the statistics of the games of a log.
+
+    Pre: 'path' is a log written by gamelog.GameLogWriter.
+    Post: The returned dictionary holds:
+          'games', 'firstwins', 'secondwins', 'draws' and 'forfeits' counts;
+          'length' the number of games by number of placements (0 to 16);
+          'square' and 'piece' (3, 16) arrays counting, by opening square
+          and by first given piece, the games and the wins of the first and
+          of the second player;
+          'positions' and 'unsafe' the number of positions reached after
+          each placement and of those without any safe piece to give.
+    '''
+    records = gamelog.load(path)
+    stats = {
+        'games': len(records), 'firstwins': 0, 'secondwins': 0, 'draws': 0, 'forfeits': 0,
+        'length': np.zeros(bitboard.NB_SQUARES + 1, dtype=np.int64),
+        'square': np.zeros((3, bitboard.NB_SQUARES), dtype=np.int64),
+        'piece': np.zeros((3, bitboard.NB_PIECES), dtype=np.int64),
+        'positions': np.zeros(bitboard.NB_SQUARES, dtype=np.int64),
+        'unsafe': np.zeros(bitboard.NB_SQUARES, dtype=np.int64)
+    }
+    for start in range(0, len(records), chunksize):
+        # Copy the chunk out of the mapping, the file pages can then be dropped
+        chunk = np.array(records[start:start + chunksize])
+        firstwin, secondwin, draw = _outcomes(chunk)
+        stats['firstwins'] += int(np.count_nonzero(firstwin))
+        stats['secondwins'] += int(np.count_nonzero(secondwin))
+        stats['draws'] += int(np.count_nonzero(draw))
+        stats['forfeits'] += int(np.count_nonzero(chunk['flags'] & gamelog.FORFEIT))
+        length = (chunk['placements'] != gamelog.NONE).sum(axis=1)
+        stats['length'] += np.bincount(length, minlength=bitboard.NB_SQUARES + 1)
+        _bykey(stats, 'square', chunk['placements'][:, 0], firstwin, secondwin)
+        _bykey(stats, 'piece', chunk['given'][:, 0], firstwin, secondwin)
+        _safety(stats, chunk)
+    return stats
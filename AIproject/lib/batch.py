@@ -0,0 +1,93 @@
+# batch.py
+# Vectorized evaluation of many Quarto positions at once (requires NumPy).
+
+# A batch of N positions is given as an (N, 16) int8 array of squares (the
+# 4-bit piece or -1 for an empty square), an (N,) array of 16-bit masks of
+# the remaining pieces (the piece to play included, as in Board.remaining)
+# and an (N,) int8 array of pieces to play (-1 for none). Every query is a
+# few NumPy operations over the line table used by QuartoState.winner().
+
+import numpy as np
+
+from . import bitboard
+
+# winners() codes for the two non-player outcomes of QuartoState.winner()
+ONGOING = -1
+DRAW = -2
+
+LINES = np.array(bitboard.LINES, dtype=np.intp)
+_BITS = np.arange(len(bitboard.ATTRIBUTES), dtype=np.int8)
+_SQUARE_BITS = (1 << np.arange(bitboard.NB_SQUARES, dtype=np.int64))
+_PIECE_BITS = (1 << np.arange(bitboard.NB_PIECES, dtype=np.int64))
+# (8, 16) table of the pieces having each attribute value
+_VALUE_PIECES = np.array(
+    [[values >> p & 1 for p in range(bitboard.NB_PIECES)] for values in bitboard.VALUE_PIECES],
+    dtype=bool
+)
+
+
+def fromboards(boards):
+    '''Return the (squares, remaining, pieces) arrays of a list of Board.'''
+    squares = np.array([board.squares for board in boards], dtype=np.int8).reshape(-1, bitboard.NB_SQUARES)
+    remaining = np.array([board.remaining for board in boards], dtype=np.int64)
+    pieces = np.array([board.piece for board in boards], dtype=np.int8)
+    return squares, remaining, pieces
+
+
+def _linebits(squares):
+    # (N, 10, 4 squares, 4 attributes) attribute bits and (N, 10, 4) occupancy
+    lines = squares[:, LINES]
+    occupied = lines >= 0
+    bits = (lines[..., None] >> _BITS) & 1
+    return bits.astype(bool), occupied
+
+
+def _pack(flags, weights):
+    return (flags * weights).sum(axis=-1)
+
+
+def quartos(squares):
+    '''Return the (N,) boolean array of the boards holding a quarto.'''
+    bits, occupied = _linebits(squares)
+    full = occupied.all(axis=2)
+    common = bits.all(axis=2) | (~bits).all(axis=2)
+    return (full & common.any(axis=2)).any(axis=1)
+
+
+def winners(squares, announced, players):
+    '''Vectorized QuartoState.winner().
+
+    Pre: 'announced' is the (N,) quartoAnnounced flags and 'players' the
+         (N,) current players.
+    Post: The returned (N,) array holds the winning player, ONGOING if
+          there is no winner yet or DRAW for a full board without winner.
+    '''
+    won = np.asarray(announced, dtype=bool) & quartos(squares)
+    full = (squares >= 0).all(axis=1)
+    return np.where(won, np.asarray(players), np.where(full, DRAW, ONGOING)).astype(np.int8)
+
+
+def legalmoves(squares, remaining, pieces):
+    '''Return the (N,) 16-bit masks of the free squares where the piece to
+    play can go and of the pieces that can be given next.'''
+    pieces = np.asarray(pieces, dtype=np.int64)
+    played = np.where(pieces >= 0, 1 << np.maximum(pieces, 0), 0)
+    freesquares = _pack(squares < 0, _SQUARE_BITS)
+    nextpieces = np.asarray(remaining, dtype=np.int64) & ~played
+    return freesquares, nextpieces
+
+
+def safepieces(squares, remaining, pieces):
+    '''Vectorized Board.safepieces(): the (N,) 16-bit masks of the pieces
+    that can be given without allowing an immediate quarto.'''
+    bits, occupied = _linebits(squares)
+    three = occupied.sum(axis=2) == 3
+    ones = (bits & occupied[..., None]).sum(axis=2)
+    zeros = (~bits & occupied[..., None]).sum(axis=2)
+    # (N, 10, 8) attribute values shared by the three pieces of a line,
+    # value 2*b + v for bit b equal to v as in bitboard.PIECE_VALUES
+    values = np.stack((zeros == 3, ones == 3), axis=-1).reshape(len(squares), len(LINES), -1)
+    threats = (values & three[..., None]).any(axis=1)
+    unsafe = (threats.astype(np.int64) @ _VALUE_PIECES.astype(np.int64)) > 0
+    _, nextpieces = legalmoves(squares, remaining, pieces)
+    return nextpieces & ~_pack(unsafe, _PIECE_BITS)
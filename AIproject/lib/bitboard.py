@@ -0,0 +1,412 @@
+# bitboard.py
+# Compact bitboard engine for the Quarto game.
+
+# A piece is a 4-bit integer with one bit per attribute (see ATTRIBUTES).
+# Its value is also its index in the initial list of remaining pieces
+# built by QuartoState, so 0 is a round dark low empty piece and 15 a
+# square light high full one.
+#
+# The board keeps one 16-bit occupancy mask plus, for every attribute,
+# the 16-bit mask of the squares holding a piece with that bit set:
+#
+# 00 01 02 03
+# 04 05 06 07
+# 08 09 10 11
+# 12 13 14 15
+
+import json
+import random
+
+ATTRIBUTES = (
+    ('filling', ('empty', 'full')),
+    ('height', ('low', 'high')),
+    ('color', ('dark', 'light')),
+    ('shape', ('round', 'square'))
+)
+
+NB_PIECES = 16
+NB_SQUARES = 16
+FULL = (1 << NB_SQUARES) - 1
+
+LINES = tuple(
+    [tuple(4 * i + e for e in range(4)) for i in range(4)] +
+    [tuple(4 * e + i for e in range(4)) for i in range(4)] +
+    [tuple(5 * e for e in range(4)), tuple(3 + 3 * e for e in range(4))]
+)
+LINE_MASKS = tuple(sum(1 << sq for sq in line) for line in LINES)
+SQUARE_LINES = tuple(tuple(l for l, line in enumerate(LINES) if sq in line) for sq in range(NB_SQUARES))
+
+# Each line keeps a packed counter with one 3-bit field per attribute value
+# (field 2*b + v counts the pieces whose bit b equals v). A field reaches 4
+# exactly when the line holds four pieces sharing that attribute value.
+FIELD_BITS = 3
+NB_VALUES = 2 * len(ATTRIBUTES)
+PIECE_COUNTS = tuple(
+    sum(1 << FIELD_BITS * (2 * b + (p >> b & 1)) for b in range(len(ATTRIBUTES)))
+    for p in range(NB_PIECES)
+)
+FOUR_MASK = sum(4 << FIELD_BITS * k for k in range(NB_VALUES))
+LOW_MASK = sum(1 << FIELD_BITS * k for k in range(NB_VALUES))
+
+# Attribute values of a piece, as indexes of counter fields and as an 8-bit mask
+PIECE_VALUES = tuple(
+    tuple(2 * b + (p >> b & 1) for b in range(len(ATTRIBUTES)))
+    for p in range(NB_PIECES)
+)
+PIECE_VALUE_MASKS = tuple(sum(1 << k for k in values) for values in PIECE_VALUES)
+# 16-bit mask of the pieces having each attribute value
+VALUE_PIECES = tuple(
+    sum(1 << p for p in range(NB_PIECES) if k in PIECE_VALUES[p])
+    for k in range(NB_VALUES)
+)
+
+# Maps the low bits of the fields equal to 3 in a line counter to the 8-bit
+# mask of the attribute values shared by three pieces of that line
+THREE_VALUES = {
+    sum(1 << FIELD_BITS * k for k in range(NB_VALUES) if values >> k & 1): values
+    for values in range(1 << NB_VALUES)
+}
+
+
+# Categories of moves generated by Board.moves(), in their default order
+WINNING, SAFE, UNSAFE = 'winning', 'safe', 'unsafe'
+MOVE_ORDER = (WINNING, SAFE, UNSAFE)
+
+# Zobrist keys of the pieces on squares, of the piece to play and of the side
+# to move (parity of the moves played). PIECE_KEYS has a 17th key for the
+# piece -1 so that it can be indexed with the piece to play directly.
+_random = random.Random(0x51A7)
+SQUARE_KEYS = tuple(tuple(_random.getrandbits(64) for p in range(NB_PIECES)) for sq in range(NB_SQUARES))
+PIECE_KEYS = tuple(_random.getrandbits(64) for p in range(NB_PIECES)) + (0,)
+SIDE_KEY = _random.getrandbits(64)
+del _random
+
+
+def encodepiece(piece):
+    '''Return the 4-bit integer of a piece given as a Piece or in its JSON form.'''
+    if isinstance(piece, Piece):
+        return piece.code
+    code = 0
+    for bit, (name, values) in enumerate(ATTRIBUTES):
+        code |= values.index(piece[name]) << bit
+    return code
+
+
+def decodepiece(code):
+    '''Return the JSON form of a 4-bit piece.'''
+    return {name: values[(code >> bit) & 1] for bit, (name, values) in enumerate(ATTRIBUTES)}
+
+
+# Attributes in the order of the JSON objects sent by QuartoState
+JSON_ATTRIBUTES = ('shape', 'color', 'height', 'filling')
+
+
+class Piece(dict):
+    '''Immutable Quarto piece. The 16 pieces are interned in PIECES, so that
+    pieces are shared and compared by identity.
+
+    A piece is also a read-only dict of its JSON form, equal to that form,
+    so that the code written for the dict pieces keeps working.
+    '''
+    __slots__ = ('code', 'shape', 'color', 'height', 'filling', 'display', 'json')
+
+    def __init__(self, code):
+        attributes = decodepiece(code)
+        dict.__init__(self, ((name, attributes[name]) for name in JSON_ATTRIBUTES))
+        setattr = object.__setattr__
+        setattr(self, 'code', code)
+        for name, value in attributes.items():
+            setattr(self, name, value)
+        bracket = ('(', ')') if self.shape == 'round' else ('[', ']')
+        filling = 'E' if self.filling == 'empty' else 'F'
+        color = 'L' if self.color == 'light' else 'D'
+        format = ' {}{}{}{} ' if self.height == 'low' else '{0}{0}{1}{2}{3}{3}'
+        setattr(self, 'display', format.format(bracket[0], filling, color, bracket[1]))
+        setattr(self, 'json', json.dumps(self, separators=(',', ':')))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Piece objects are immutable')
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('Piece objects are immutable')
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    # Equal pieces have the same code, dicts are not hashable
+    def __hash__(self):
+        return self.code
+
+    def __reduce__(self):
+        # Copies and unpickled pieces are the interned ones
+        return _piece, (self.code,)
+
+    def __repr__(self):
+        return 'Piece({})'.format(self.code)
+
+    def tojson(self):
+        '''Return the JSON form of the piece, as a new dict.'''
+        return dict(self)
+
+
+def _piece(code):
+    return PIECES[code]
+
+
+PIECES = tuple(Piece(code) for code in range(NB_PIECES))
+_PIECE_INDEX = {tuple(piece.tojson().values()): piece for piece in PIECES}
+
+
+def topiece(piece):
+    '''Return the interned Piece of a piece given as a Piece or in its JSON form.'''
+    if isinstance(piece, Piece):
+        return piece
+    return _PIECE_INDEX[piece['shape'], piece['color'], piece['height'], piece['filling']]
+
+
+def piecelist(mask):
+    '''Return the pieces of a 16-bit piece mask in increasing order.'''
+    return [p for p in range(NB_PIECES) if mask >> p & 1]
+
+
+class Board:
+    '''Compact Quarto position: squares, remaining pieces and piece to play.'''
+    def __init__(self):
+        self.squares = [-1] * NB_SQUARES
+        self.occupied = 0
+        self.ones = [0] * len(ATTRIBUTES)
+        self.remaining = (1 << NB_PIECES) - 1
+        self.piece = -1
+        self.counts = [0] * len(LINES)
+        # Number of lines currently holding a quarto
+        self.quartos = 0
+        # Attribute values completing each line holding exactly three pieces
+        self.threats = [0] * len(LINES)
+        self._valuesquares = None
+        self._unsafe = None
+        # Zobrist hash of the position, updated on every move
+        self.hash = 0
+        # Flat undo stack of (pos, piece to play before the move) pairs
+        self._history = []
+
+    @classmethod
+    def fromvisible(cls, visible):
+        '''Build a board from the 'visible' part of a QuartoState.'''
+        board = cls()
+        board.remaining = 0
+        for piece in visible['remainingPieces']:
+            board.remaining |= 1 << encodepiece(piece)
+        for pos, piece in enumerate(visible['board']):
+            if piece is not None:
+                board._set(pos, encodepiece(piece))
+        if visible['pieceToPlay'] is not None:
+            board.piece = encodepiece(visible['remainingPieces'][visible['pieceToPlay']])
+        board.hash = board.zobrist()
+        return board
+
+    def copy(self):
+        board = Board.__new__(Board)
+        board.squares = self.squares[:]
+        board.occupied = self.occupied
+        board.ones = self.ones[:]
+        board.remaining = self.remaining
+        board.piece = self.piece
+        board.counts = self.counts[:]
+        board.quartos = self.quartos
+        board.threats = self.threats[:]
+        board._valuesquares = self._valuesquares
+        board._unsafe = self._unsafe
+        board.hash = self.hash
+        board._history = self._history[:]
+        return board
+
+    def _set(self, pos, piece):
+        bit = 1 << pos
+        self.squares[pos] = piece
+        self.occupied |= bit
+        self.hash ^= SQUARE_KEYS[pos][piece]
+        ones = self.ones
+        for b in range(4):
+            if piece >> b & 1:
+                ones[b] |= bit
+        add = PIECE_COUNTS[piece]
+        counts = self.counts
+        for l in SQUARE_LINES[pos]:
+            count = counts[l] + add
+            counts[l] = count
+            if count & FOUR_MASK:
+                self.quartos += 1
+            self._updatethreat(l, count)
+        self._valuesquares = None
+        self._unsafe = None
+
+    def _unset(self, pos):
+        mask = ~(1 << pos)
+        piece = self.squares[pos]
+        self.squares[pos] = -1
+        self.occupied &= mask
+        self.hash ^= SQUARE_KEYS[pos][piece]
+        ones = self.ones
+        for b in range(4):
+            if piece >> b & 1:
+                ones[b] &= mask
+        sub = PIECE_COUNTS[piece]
+        counts = self.counts
+        for l in SQUARE_LINES[pos]:
+            if counts[l] & FOUR_MASK:
+                self.quartos -= 1
+            count = counts[l] - sub
+            counts[l] = count
+            self._updatethreat(l, count)
+        self._valuesquares = None
+        self._unsafe = None
+        return piece
+
+    def _updatethreat(self, line, count):
+        # The two fields of an attribute always sum to the number of pieces
+        if (count & 7) + (count >> FIELD_BITS & 7) == 3:
+            self.threats[line] = THREE_VALUES[count & (count >> 1) & LOW_MASK]
+        else:
+            self.threats[line] = 0
+
+    def remainingpieces(self):
+        '''Return the remaining pieces in increasing order, as in the wire format.'''
+        return piecelist(self.remaining)
+
+    def isfree(self, pos):
+        return not self.occupied >> pos & 1
+
+    def isfull(self):
+        return self.occupied == FULL
+
+    def place(self, pos):
+        '''Place the piece to play on the square 'pos'.
+
+        Pre: 'pos' is free and there is a piece to play
+        Post: The piece is on the board and no piece is left to play
+        '''
+        self._set(pos, self.piece)
+        self.remaining &= ~(1 << self.piece)
+        self.piece = -1
+
+    def push(self, pos, piece):
+        '''Play a move and record it so that it can be undone with pop().
+
+        Pre: 'pos' is free (-1 if there is no piece to play yet) and 'piece'
+             is a remaining piece other than the one to play (-1 if none is left)
+        Post: The piece to play is on 'pos' and 'piece' is the next one to play
+        '''
+        self._history.append(pos)
+        self._history.append(self.piece)
+        self.hash ^= PIECE_KEYS[self.piece] ^ PIECE_KEYS[piece] ^ SIDE_KEY
+        if pos != -1:
+            self.place(pos)
+        self.piece = piece
+
+    def pop(self):
+        '''Undo the last move played with push().'''
+        piece = self._history.pop()
+        pos = self._history.pop()
+        self.hash ^= PIECE_KEYS[self.piece] ^ PIECE_KEYS[piece] ^ SIDE_KEY
+        if pos != -1:
+            self._unset(pos)
+            self.remaining |= 1 << piece
+        self.piece = piece
+
+    def zobrist(self):
+        '''Compute the Zobrist hash of this position from scratch.'''
+        key = PIECE_KEYS[self.piece]
+        placed = 0
+        for pos, piece in enumerate(self.squares):
+            if piece != -1:
+                key ^= SQUARE_KEYS[pos][piece]
+                placed += 1
+        # The first move only gives a piece, every other one places a piece
+        if (placed + (self.piece != -1 or placed > 0)) & 1:
+            key ^= SIDE_KEY
+        return key
+
+    def hasquarto(self):
+        '''Check whether a line holds four pieces sharing an attribute.'''
+        return self.quartos > 0
+
+    def _threatsquares(self):
+        valuesquares = self._valuesquares
+        if valuesquares is None:
+            valuesquares = [0] * NB_VALUES
+            occupied = self.occupied
+            for l, values in enumerate(self.threats):
+                if values:
+                    square = LINE_MASKS[l] & ~occupied
+                    for k in range(NB_VALUES):
+                        if values >> k & 1:
+                            valuesquares[k] |= square
+            self._valuesquares = valuesquares
+        return valuesquares
+
+    def winningsquares(self, piece):
+        '''Return the 16-bit mask of the free squares where 'piece' makes a quarto.'''
+        valuesquares = self._threatsquares()
+        a, b, c, d = PIECE_VALUES[piece]
+        return valuesquares[a] | valuesquares[b] | valuesquares[c] | valuesquares[d]
+
+    def safepieces(self):
+        '''Return the 16-bit mask of the remaining pieces, other than the one to
+        play, that can be given without allowing an immediate quarto.'''
+        unsafe = self._unsafe
+        if unsafe is None:
+            values = 0
+            for threat in self.threats:
+                values |= threat
+            unsafe = 0
+            for k in range(NB_VALUES):
+                if values >> k & 1:
+                    unsafe |= VALUE_PIECES[k]
+            self._unsafe = unsafe
+        safe = self.remaining & ~unsafe
+        if self.piece != -1:
+            safe &= ~(1 << self.piece)
+        return safe
+
+    def moves(self, order=MOVE_ORDER):
+        '''Generate the legal (pos, piece) moves lazily, category by category.
+
+        'order' lists the categories to generate: WINNING (the placement
+        makes a quarto), SAFE (the given piece cannot make a quarto, or no
+        piece is left to give) and UNSAFE (all the others). The board must
+        not be modified between two steps of the generator.
+        '''
+        piece = self.piece
+        if piece == -1:
+            if self.occupied == FULL:
+                return
+            positions = [-1]
+            winning = 0
+        else:
+            winning = self.winningsquares(piece)
+            free = FULL & ~self.occupied & ~winning
+            positions = [pos for pos in range(NB_SQUARES) if free >> pos & 1]
+        for category in order:
+            if category == WINNING:
+                if not winning:
+                    continue
+                remaining = piecelist(self.remaining & ~(1 << piece)) or [-1]
+                for pos in range(NB_SQUARES):
+                    if winning >> pos & 1:
+                        for nextPiece in remaining:
+                            yield pos, nextPiece
+                continue
+            for pos in positions:
+                self.push(pos, -1)
+                remaining = self.remaining
+                safe = self.safepieces()
+                self.pop()
+                if category == SAFE:
+                    if not remaining:
+                        yield pos, -1
+                    else:
+                        for nextPiece in piecelist(safe):
+                            yield pos, nextPiece
+                else:
+                    for nextPiece in piecelist(remaining & ~safe):
+                        yield pos, nextPiece
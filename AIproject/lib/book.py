@@ -0,0 +1,129 @@
+# book.py
+# Memory-mapped opening book for the Quarto game.
+
+# A book file is a header (holding the number of positions and the number
+# of opening moves covered) followed by fixed-size records sorted by key:
+# the 64-bit hash of a canonical position (see symmetry.canonical()), then
+# the best move found for that canonical position and its score. Lookups
+# binary search the file through mmap, so a book costs no load time and its
+# pages are shared by all the processes reading it. Positions deeper than
+# the book are answered without computing their key.
+
+import hashlib
+import mmap
+import struct
+
+from . import bitboard
+from . import symmetry
+
+MAGIC = b'QBK2'
+# magic, count, plies
+HEADER = struct.Struct('<4sII')
+# key, pos, piece, score
+RECORD = struct.Struct('<Qbbh')
+
+
+def positionkey(board):
+    '''Return the (64-bit book key, symmetry) pair of the position on 'board'.'''
+    key, sym = symmetry.canonical(board)
+    digest = hashlib.blake2b(key.to_bytes(11, 'little'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little'), sym
+
+
+def openings(plies):
+    '''Return the canonical boards reachable within 'plies' moves, without
+    ever giving a piece that allows a quarto.'''
+    board = bitboard.Board()
+    frontier = [board]
+    seen = {positionkey(board)[0]}
+    found = [board]
+    for _ in range(plies):
+        following = []
+        for board in frontier:
+            for move in board.moves((bitboard.SAFE,)):
+                child = board.copy()
+                child.push(*move)
+                key, sym = positionkey(child)
+                if key not in seen:
+                    seen.add(key)
+                    child = sym.transform(child)
+                    following.append(child)
+                    found.append(child)
+        frontier = following
+    return found
+
+
+def build(path, plies, searcher, progress=None):
+    '''Search every opening position of at most 'plies' moves with 'searcher'
+    (a search.Searcher) and write the book to 'path'. 'progress' is called
+    with (done, total) after each position.'''
+    boards = openings(plies)
+    records = []
+    for i, board in enumerate(boards):
+        key, sym = positionkey(board)
+        result = searcher.search(board)
+        # The search ran on a canonical board, express the move in its frame
+        records.append((key,) + sym.apply(result.move) + (result.score,))
+        if progress is not None:
+            progress(i + 1, len(boards))
+    records.sort()
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(records), plies))
+        for record in records:
+            file.write(RECORD.pack(*record))
+    return len(records)
+
+
+class OpeningBook:
+    '''Read-only opening book mapped in memory.'''
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, self._plies = HEADER.unpack_from(self._map, 0) if len(self._map) >= HEADER.size else (None, 0, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError('{} is not an opening book'.format(path))
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def plies(self):
+        '''Number of opening moves covered by the book.'''
+        return self._plies
+
+    def close(self):
+        self._map.close()
+
+    def _find(self, key):
+        data = self._map
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            record = RECORD.unpack_from(data, HEADER.size + middle * RECORD.size)
+            if record[0] < key:
+                low = middle + 1
+            elif record[0] > key:
+                high = middle
+            else:
+                return record
+        return None
+
+    def lookup(self, board):
+        '''Return the book move of the position on 'board', None if unknown.'''
+        # After 'plies' moves, one square less than moves played is occupied
+        if bin(board.occupied).count('1') >= self._plies:
+            return None
+        key, sym = positionkey(board)
+        record = self._find(key)
+        if record is None:
+            return None
+        move = sym.revert(record[1:3])
+        # Guard against a key collision with another position
+        pos, piece = move
+        if (pos == -1) != (board.piece == -1) or pos != -1 and not board.isfree(pos):
+            return None
+        remaining = board.remaining & ~(1 << board.piece) if board.piece != -1 else board.remaining
+        if piece == -1 and remaining or piece != -1 and not remaining >> piece & 1:
+            return None
+        return move
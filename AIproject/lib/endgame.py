@@ -0,0 +1,176 @@
+# endgame.py
+# Exact solver for Quarto positions with few empty squares.
+
+# The solver runs a full-depth negamax with a null window around the three
+# possible outcomes (LOSS, DRAW and WIN, seen from the player to move).
+# Bounds are kept in a Zobrist transposition table, and exact results of
+# positions with enough empty squares are also cached by canonical key, so
+# that symmetric positions and later calls in the same process reuse them.
+# With a time limit, a search running out of time returns the best move
+# among the root moves solved so far.
+
+import time
+
+from . import bitboard
+from . import search
+from . import symmetry
+from . import transposition
+
+LOSS, DRAW, WIN = -1, 0, 1
+# Solved within a tenth of a second, seldom more
+DEFAULT_THRESHOLD = 7
+# Positions with fewer empty squares are cheaper to solve than to canonicalize
+CANONICAL_MIN_EMPTY = 5
+CACHE_LIMIT = 1 << 20
+# Number of nodes between two checks of the clock, nodes are much slower
+# than those of search.Searcher
+CHECK_INTERVAL = 64
+
+# Exact results by canonical key, shared by all the solvers of the process
+_cache = {}
+
+
+def clearcache():
+    _cache.clear()
+
+
+class Solution:
+    '''Proven outcome of a position and a move achieving it.
+
+    A search out of time is not 'complete': 'result' is then only what
+    'move' achieves at least, None with 'move' if no root move was solved.
+    '''
+    def __init__(self, result, move, nodes, elapsed, complete=True):
+        self.result = result
+        self.move = move
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.complete = complete
+
+    @property
+    def nps(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return 'Solution(result={}, move={}, nodes={}, nps={:.0f}{})'.format(
+            {LOSS: 'loss', DRAW: 'draw', WIN: 'win', None: 'unknown'}[self.result], self.move, self.nodes, self.nps,
+            '' if self.complete else ', incomplete'
+        )
+
+
+class EndgameSolver:
+    '''Exact solver used for positions with at most 'threshold' empty squares.
+
+    'timelimit' is the wall-clock budget of a search in seconds, None for
+    no limit.
+    '''
+    def __init__(self, threshold=DEFAULT_THRESHOLD, table=None, timelimit=None):
+        self.threshold = threshold
+        self.timelimit = timelimit
+        self.table = table if table is not None else transposition.TranspositionTable()
+        self.nodes = 0
+
+    def accepts(self, board):
+        '''Whether 'board' has few enough empty squares to be solved.'''
+        return bitboard.NB_SQUARES - bin(board.occupied).count('1') <= self.threshold
+
+    def search(self, board):
+        '''Solve the position on 'board'.
+
+        Pre: The game on 'board' is not over and a piece is to be played.
+        Post: The returned Solution holds the exact outcome with perfect play
+              and a move achieving it, or the best solved root move if the
+              time limit was reached. 'board' is left unchanged.
+        '''
+        board = board.copy()
+        start = time.monotonic()
+        self._deadline = start + self.timelimit if self.timelimit is not None else None
+        self.nodes = 0
+        piece = board.piece
+        winning = board.winningsquares(piece)
+        if winning:
+            return Solution(WIN, next(board.moves((bitboard.WINNING,))), 1, time.monotonic() - start)
+
+        best, bestmove = LOSS - 1, None
+        try:
+            for pos, nextPiece, score in self._moves(board, LOSS - 1, WIN + 1):
+                if score > best:
+                    best, bestmove = score, (pos, nextPiece)
+                    if best == WIN:
+                        break
+        except search.SearchTimeout:
+            # The scores of the solved root moves are exact
+            return Solution(best if bestmove is not None else None, bestmove, self.nodes, time.monotonic() - start, False)
+        return Solution(best, bestmove, self.nodes, time.monotonic() - start)
+
+    def _moves(self, board, alpha, beta):
+        # Yield (pos, nextPiece, score) for the moves of the player to move,
+        # scores of the searched children being bounds within (alpha, beta).
+        # Moves giving an unsafe piece lose and are only yielded when there
+        # is no safe move at all.
+        found = False
+        for move in board.moves((bitboard.SAFE,)):
+            found = True
+            board.push(*move)
+            score = -self._solve(board, -beta, -alpha)
+            board.pop()
+            yield move + (score,)
+            if score > alpha:
+                alpha = score
+        if not found:
+            yield next(board.moves((bitboard.UNSAFE,))) + (LOSS,)
+
+    def _solve(self, board, alpha, beta):
+        self.nodes += 1
+        if self._deadline is not None and self.nodes % CHECK_INTERVAL == 0 and time.monotonic() > self._deadline:
+            raise search.SearchTimeout()
+        if board.piece == -1:
+            # The board is full without a quarto
+            return DRAW
+        if board.winningsquares(board.piece):
+            return WIN
+
+        empty = bitboard.NB_SQUARES - bin(board.occupied).count('1')
+        key = None
+        if empty >= CANONICAL_MIN_EMPTY:
+            # Canonicalizing takes tens of microseconds, check the clock first
+            if self._deadline is not None and time.monotonic() > self._deadline:
+                raise search.SearchTimeout()
+            key = symmetry.canonical(board)[0]
+            if key in _cache:
+                return _cache[key]
+
+        entry = self.table.probe(board.hash)
+        if entry is not None:
+            score, depth, bound, move = entry
+            if bound == transposition.EXACT:
+                return score
+            if bound == transposition.LOWER and score >= beta:
+                return score
+            if bound == transposition.UPPER and score <= alpha:
+                return score
+
+        origalpha = alpha
+        best = LOSS - 1
+        bestmove = None
+        for pos, nextPiece, score in self._moves(board, alpha, beta):
+            if score > best:
+                best, bestmove = score, (pos, nextPiece)
+                if best > alpha:
+                    alpha = best
+                    if alpha >= beta or best == WIN:
+                        break
+
+        # WIN and LOSS are exact even when outside of the window
+        if best == WIN or best == LOSS or origalpha < best < beta:
+            bound = transposition.EXACT
+            if key is not None:
+                if len(_cache) >= CACHE_LIMIT:
+                    _cache.clear()
+                _cache[key] = best
+        elif best >= beta:
+            bound = transposition.LOWER
+        else:
+            bound = transposition.UPPER
+        self.table.store(board.hash, best, empty, bound, bestmove)
+        return best
@@ -3,13 +3,41 @@
 # Version: April 20, 2016
 
 from abc import *
-import copy
+import asyncio
+import contextlib
+import io
 import json
 import socket
+import struct
 import sys
+import threading
+import time
+
+from . import logger
+from . import metrics
 
 DEFAULT_BUFFER_SIZE = 2048
-SECTION_WIDTH = 60
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 5000
+SECTION_WIDTH = logger.SECTION_WIDTH
+# Every message is preceded by its length
+HEADER = struct.Struct('!I')
+MAX_MESSAGE_SIZE = 1 << 24
+# Commands are short words followed by a space and their payload
+COMMAND_SIZE = 16
+# Seconds a player has to answer START, so that a silent client does not
+# stall its opponent
+HANDSHAKE_TIMEOUT = 10.0
+
+# Server metrics, exported by metrics.MetricsServer
+TURN_SECONDS = metrics.REGISTRY.histogram('game_turn_seconds', 'Time from a PLAY message to the move of the player.', labels=('player',))
+APPLYMOVE_SECONDS = metrics.REGISTRY.histogram('game_applymove_seconds', 'Time spent in GameServer.applymove.', metrics.CPU_BUCKETS)
+WINNER_SECONDS = metrics.REGISTRY.histogram('game_winner_seconds', 'Time spent in GameState.winner.', metrics.CPU_BUCKETS)
+SERIALIZE_SECONDS = metrics.REGISTRY.histogram('game_serialize_seconds', 'Time spent encoding states and decoding moves.', metrics.CPU_BUCKETS, labels=('codec', 'operation'))
+BYTES = metrics.REGISTRY.counter('game_bytes_total', 'Bytes exchanged with the players.', labels=('direction',))
+GAMES = metrics.REGISTRY.counter('game_games_total', 'Games finished, by result.', labels=('result',))
+INVALID_MOVES = metrics.REGISTRY.counter('game_invalid_moves_total', 'Moves rejected by the server.', labels=('player',))
+RUNNING_GAMES = metrics.REGISTRY.gauge('game_running_games', 'Games being played by the lobby.')
 
 
 def _printsection(title):
@@ -23,16 +51,270 @@ class InvalidMoveException(Exception):
         super().__init__(message)
 
 
+class Connection:
+    '''Socket exchanging length-prefixed messages.
+
+    Received data goes into a single reusable buffer, grown only for the
+    messages that do not fit, and messages are handed out as memoryviews
+    of it, without copy.
+    '''
+    def __init__(self, sock, buffersize=DEFAULT_BUFFER_SIZE):
+        if sock.family in (socket.AF_INET, socket.AF_INET6):
+            # Messages are small and answered, do not wait to coalesce them
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._socket = sock
+        self._buffer = bytearray(max(buffersize, HEADER.size))
+        self._view = memoryview(self._buffer)
+        # Received bytes not handed out yet are self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = 0
+        # Bytes sent and received, framing included
+        self.sent = 0
+        self.received = 0
+
+    def close(self):
+        self._socket.close()
+
+    def send(self, data):
+        '''Send the bytes 'data' as one message.'''
+        self._socket.sendall(HEADER.pack(len(data)) + data)
+        self.sent += HEADER.size + len(data)
+
+    def recv(self, timeout=None):
+        '''Receive the next message, waiting at most 'timeout' seconds.
+
+        Pre: -
+        Post: The returned value is a memoryview of the message, valid until
+              the next call to recv.
+        Raises ConnectionError: If the connection is closed or the message
+                                is too large.
+        Raises TimeoutError: If the whole message did not arrive in time.
+        '''
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        self._fill(HEADER.size, deadline)
+        size, = HEADER.unpack_from(self._buffer, self._start)
+        if size > MAX_MESSAGE_SIZE:
+            raise ConnectionError('Message of {} bytes is too large'.format(size))
+        self._fill(HEADER.size + size, deadline)
+        self.received += HEADER.size + size
+        start = self._start + HEADER.size
+        self._start = start + size
+        return self._view[start:self._start]
+
+    def _fill(self, size, deadline):
+        # Receive until self._buffer[self._start:] holds 'size' bytes
+        if self._end - self._start >= size:
+            return
+        pending = self._end - self._start
+        if size > len(self._buffer):
+            # A new buffer keeps the memoryviews already handed out valid
+            buffer = bytearray(max(size, 2 * len(self._buffer)))
+            buffer[:pending] = self._view[self._start:self._end]
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+            self._start, self._end = 0, pending
+        elif self._start + size > len(self._buffer):
+            self._buffer[:pending] = bytes(self._view[self._start:self._end])
+            self._start, self._end = 0, pending
+        while self._end - self._start < size:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError('No message received in time')
+                self._socket.settimeout(remaining)
+            elif self._socket.gettimeout() is not None:
+                self._socket.settimeout(None)
+            try:
+                received = self._socket.recv_into(self._view[self._end:])
+            except socket.timeout:
+                raise TimeoutError('No message received in time')
+            if received == 0:
+                raise ConnectionError('Connection closed by peer')
+            self._end += received
+
+
+class AsyncConnection:
+    '''Asyncio stream exchanging the length-prefixed messages of Connection.'''
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self.sent = 0
+        self.received = 0
+
+    @property
+    def peername(self):
+        return self._writer.get_extra_info('peername')
+
+    def close(self):
+        self._writer.close()
+
+    async def send(self, data):
+        self._writer.write(HEADER.pack(len(data)) + data)
+        self.sent += HEADER.size + len(data)
+        await self._writer.drain()
+
+    async def recv(self, timeout=None):
+        '''Receive the next message as a memoryview, waiting at most 'timeout' seconds.
+
+        Raises ConnectionError: If the connection is closed or the message
+                                is too large.
+        Raises TimeoutError: If the whole message did not arrive in time.
+        '''
+        if timeout is not None:
+            try:
+                return await asyncio.wait_for(self.recv(), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError('No message received in time')
+        try:
+            size, = HEADER.unpack(await self._reader.readexactly(HEADER.size))
+            if size > MAX_MESSAGE_SIZE:
+                raise ConnectionError('Message of {} bytes is too large'.format(size))
+            data = await self._reader.readexactly(size)
+            self.received += HEADER.size + size
+            return memoryview(data)
+        except asyncio.IncompleteReadError:
+            raise ConnectionError('Connection closed by peer')
+
+
+def _splitcommand(message):
+    # Return the command of a message and a memoryview of its payload
+    head = bytes(message[:COMMAND_SIZE])
+    index = head.find(b' ')
+    if index == -1:
+        return bytes(message).decode(errors='replace'), message[len(message):]
+    return head[:index].decode(errors='replace'), message[index + 1:]
+
+
+def _splittime(payload):
+    # Return the move and game time left at the start of a timed PLAY
+    # payload, and a memoryview of the state that follows
+    head = bytes(payload[:2 * COMMAND_SIZE]).split(b' ', 2)
+    offset = len(head[0]) + len(head[1]) + 2
+    return float(head[0]), float(head[1]), payload[offset:]
+
+
+class Codec(metaclass=ABCMeta):
+    '''Abstract class representing an encoding of the states and moves
+    exchanged with the clients, negotiated when a game starts.'''
+    name = None
+
+    @abstractmethod
+    def encodestate(self, state):
+        '''Return the bytes sent in a PLAY message for 'state'.'''
+        ...
+
+    @abstractmethod
+    def decodestate(self, stateclass, data):
+        '''Return the 'stateclass' instance encoded in the bytes 'data'.'''
+        ...
+
+    @abstractmethod
+    def encodemove(self, move):
+        '''Return the bytes sent for a move returned by GameClient._nextmove.'''
+        ...
+
+    @abstractmethod
+    def decodemove(self, data):
+        '''Return the move given to GameServer.applymove for the bytes 'data'.
+
+        Raises InvalidMoveException: If 'data' does not encode a move.
+        '''
+        ...
+
+
+class JsonCodec(Codec):
+    '''Text encoding of the original protocol, supported by every game.'''
+    name = 'json'
+
+    def encodestate(self, state):
+        return str(state).encode()
+
+    def decodestate(self, stateclass, data):
+        return stateclass.parse(bytes(data).decode())
+
+    def encodemove(self, move):
+        return (move if isinstance(move, str) else json.dumps(move, separators=(',', ':'))).encode()
+
+    def decodemove(self, data):
+        try:
+            return bytes(data).decode()
+        except UnicodeDecodeError:
+            raise InvalidMoveException('A move must be an UTF-8 string')
+
+
+JSON_CODEC = JsonCodec()
+
+
+def _choosecodec(supported, offered):
+    # First codec of the client preference order known by the game
+    names = {codec.name: codec for codec in supported}
+    return next((names[name] for name in offered if name in names), JSON_CODEC)
+
+
+def _tojson(value):
+    # Objects of the states serialize themselves with a tojson() method
+    try:
+        return value.tojson()
+    except AttributeError:
+        raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+class Snapshot:
+    '''Immutable serialized copy of a game state.'''
+    __slots__ = ('_text', '_stateclass', 'currentplayer')
+
+    def __init__(self, text, stateclass, currentplayer):
+        self._text = text
+        self._stateclass = stateclass
+        self.currentplayer = currentplayer
+
+    def __str__(self):
+        return self._text
+
+    def parse(self):
+        '''Return a new mutable state equal to this snapshot.'''
+        return self._stateclass.parse(self._text)
+
+
 class GameState(metaclass=ABCMeta):
-    '''Abstract class representing a generic game state.'''
+    '''Abstract class representing a generic game state.
+
+    The serialized forms of a state are computed once and kept until the
+    state changes: the subclasses must call _changed() after each mutation.
+    '''
     def __init__(self, visible, hidden=None, currentPlayer=0):
         self._state = {'visible': visible, 'hidden': hidden, 'currentPlayer': currentPlayer}
+        # Serialized forms of the current state, by codec name (None for str)
+        self._encoded = {}
+
+    def _changed(self):
+        '''Forget the serialized forms of the state after a mutation.'''
+        if self._encoded:
+            self._encoded = {}
 
     def __str__(self):
-        return json.dumps({'visible': self._state['visible'], 'currentPlayer': self._state['currentPlayer']}, separators=(',', ':'))
+        text = self._encoded.get(None)
+        if text is None:
+            text = self._encoded[None] = self._serialize()
+        return text
+
+    def _serialize(self):
+        '''Return the JSON text sent to the players, see __str__.'''
+        return json.dumps({'visible': self._state['visible'], 'currentPlayer': self._state['currentPlayer']}, separators=(',', ':'), default=_tojson)
+
+    def encode(self, codec):
+        '''Return the bytes of this state for 'codec', encoded once per state.'''
+        data = self._encoded.get(codec.name)
+        if data is None:
+            data = self._encoded[codec.name] = codec.encodestate(self)
+        return data
+
+    def snapshot(self):
+        '''Return an immutable Snapshot of this state.'''
+        return Snapshot(str(self), self.__class__, self.currentplayer)
 
     def __repr__(self):
-        return json.dumps(self._state, separators=(',', ':'))
+        return json.dumps(self._state, separators=(',', ':'), default=_tojson)
 
     @property
     def currentplayer(self):
@@ -67,6 +349,13 @@ class GameState(metaclass=ABCMeta):
         Post: This state has been printed on stdout.'''
         ...
 
+    def render(self):
+        '''Return the text printed by prettyprint.'''
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.prettyprint()
+        return output.getvalue()
+
     @classmethod
     def parse(cls, state):
         parsed = json.loads(state)
@@ -76,16 +365,48 @@ class GameState(metaclass=ABCMeta):
     def buffersize(cls):
         return DEFAULT_BUFFER_SIZE
 
+    @classmethod
+    def codecs(cls):
+        '''Return the codecs supported by the game, preferred ones first.'''
+        return (JSON_CODEC,)
+
+
+class TimeControl:
+    '''Time allowed to the players of a game, in seconds.
+
+    Each move must be sent within 'movetime' and each player has a clock of
+    'gametime' for the whole game (None for no limit). Up to 'grace' more
+    seconds are tolerated for the network before a move is late.
+    '''
+    def __init__(self, movetime=None, gametime=None, grace=0.0):
+        self.movetime = movetime
+        self.gametime = gametime
+        self.grace = grace
+
+    def __str__(self):
+        return ' '.join('inf' if t is None else '{:.3f}'.format(t) for t in (self.movetime, self.gametime, self.grace))
+
 
 class GameServer(metaclass=ABCMeta):
     '''Abstract class representing a generic game server.'''
-    def __init__(self, name, nbplayers, initialstate, verbose=False):
+    def __init__(self, name, nbplayers, initialstate, verbose=False, host=DEFAULT_HOST, port=DEFAULT_PORT, timecontrol=None):
         self.__name = name
         self.__nbplayers = nbplayers
-        self.__verbose = verbose
+        self.__log = logger.Logger(logger.level(verbose))
+        self.__host = host
+        self.__port = port
+        self.__timecontrol = timecontrol
+        # Game clocks of the players, measured on time.monotonic()
+        gametime = timecontrol.gametime if timecontrol is not None else None
+        self.__clocks = [gametime if gametime is not None else float('inf')] * nbplayers
         self._state = initialstate
         # Stats about the running game
         self.__turns = 0
+        self.__forfeited = False
+        self.__invalid = 0
+        self.__thinking = [0.0] * nbplayers
+        self.__started = None
+        self.__duration = None
 
     @property
     def name(self):
@@ -103,6 +424,44 @@ class GameServer(metaclass=ABCMeta):
     def turns(self):
         return self.__turns
 
+    @property
+    def clocks(self):
+        '''Game time left to each player, in seconds.'''
+        return list(self.__clocks)
+
+    @property
+    def thinking(self):
+        '''Time taken by each player to answer, in seconds.'''
+        return list(self.__thinking)
+
+    @property
+    def invalid(self):
+        '''Number of invalid moves received.'''
+        return self.__invalid
+
+    @property
+    def forfeited(self):
+        '''Whether the game ended with a player out of time or disconnected.'''
+        return self.__forfeited
+
+    @property
+    def started(self):
+        '''Time at which the game started, as given by time.time().'''
+        return self.__started
+
+    @property
+    def duration(self):
+        '''Duration of the finished game in seconds, None before its end.'''
+        return self.__duration
+
+    def _finished(self, winner):
+        '''Called once a game is over, before the players are notified.
+
+        Pre: 'winner' is the result of the game, as given by GameState.winner.
+        Post: -
+        '''
+        pass
+
     @abstractmethod
     def applymove(self, move):
         '''Apply a move.
@@ -115,163 +474,423 @@ class GameServer(metaclass=ABCMeta):
 
     @property
     def state(self):
-        return copy.deepcopy(self._state)
+        return self._state.snapshot()
 
     def _waitplayers(self):
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind(('0.0.0.0', 5000))
+        s.bind((self.__host, self.__port))
         s.listen(self.nbplayers)
-        if self.__verbose:
-            _printsection('Starting {}'.format(self.name))
+        log = self.__log
+        if log.enabled(logger.GAME):
+            log.section(logger.GAME, 'Starting {}'.format(self.name))
             try:
-                print(' Game server listening on {}:{}.'.format(socket.gethostbyname(socket.gethostname()), 5000))
+                log.log(logger.GAME, ' Game server listening on {}:{}.', socket.gethostbyname(socket.gethostname()), self.__port)
             except:
-                print(' Game server listening on port {}.'.format(5000))
-            print(' Waiting for {} players...'.format(self.nbplayers))
-        self.__players = []
+                log.log(logger.GAME, ' Game server listening on port {}.', self.__port)
+            log.log(logger.GAME, ' Waiting for {} players...', self.nbplayers)
+            log.flush()
+        players = []
         # Wait for enough players for a play
         try:
-            while len(self.__players) < self.__nbplayers:
+            while len(players) < self.__nbplayers:
                 client = s.accept()[0]
-                self.__players.append(client)
-                if self.__verbose:
-                    print(' - Client connected from {}:{} ({}/{}).'
-                          .format(*client.getpeername(), len(self.__players), self.nbplayers)
-                          )
+                players.append(Connection(client, self._state.__class__.buffersize()))
+                log.log(logger.GAME, ' - Client connected from {}:{} ({}/{}).', *client.getpeername(), len(players), self.nbplayers)
+                log.flush()
         except KeyboardInterrupt:
-            for player in self.__players:
+            for player in players:
                 player.close()
             _printsection('Game server ended')
             return False
+        finally:
+            s.close()
         # Notify players that the game started
+        self.__players = players
+        self.__codecs = []
         try:
-            for i in range(len(self.__players)):
-                if self.__verbose:
-                    print(' Initialising player {}...'.format(i))
-                player = self.__players[i]
-                player.sendall('START {}'.format(i).encode())
-                data = player.recv(self._state.__class__.buffersize()).decode().split(' ')
-                if data[0] != 'READY':
-                    if self.__verbose:
-                        print(' - Player {} not ready to start.'.format(i))
-                        _printsection('Current game ended')
-                    return False
-                elif self.__verbose:
-                    print(' - Player {} ({}) ready to start.'.format(i, data[1] if len(data) == 2 else 'Anonymous'))
+            for i, player in enumerate(players):
+                log.log(logger.GAME, ' Initialising player {}...', i)
+                player.send('START {}'.format(i).encode())
+                ready, replies = self._ready(i, player.recv(HANDSHAKE_TIMEOUT))
+                if not ready:
+                    break
+                for reply in replies:
+                    player.send(reply)
         except OSError:
-            if self.__verbose:
-                print('Error while notifying player {}.'.format(player))
+            log.log(logger.GAME, 'Error while notifying player {}.', i)
+            ready = False
+        if not ready:
+            for player in players:
+                player.close()
+            log.flush()
             return False
         # Start the game since all the players are ready
-        if self.__verbose:
-            _printsection('Game initialised (all players ready to start)')
+        log.section(logger.GAME, 'Game initialised (all players ready to start)')
+        log.flush()
         return True
 
+    def _ready(self, i, data):
+        # Handle the answer of player i to START, return whether it is ready
+        # and the CODEC and TIME messages to send back
+        data = bytes(data).decode(errors='replace').split(' ')
+        if data[0] != 'READY':
+            self.__log.log(logger.GAME, ' - Player {} not ready to start.', i)
+            self.__log.section(logger.GAME, 'Current game ended')
+            return False, []
+        # READY [name] [codecs=name,...], clients without codecs speak JSON
+        offers = [token for token in data[1:] if token.startswith('codecs=')]
+        names = [token for token in data[1:] if not token.startswith('codecs=')]
+        codec, replies = JSON_CODEC, []
+        if offers:
+            codec = _choosecodec(self._state.__class__.codecs(), offers[0][len('codecs='):].split(','))
+            replies.append('CODEC {}'.format(codec.name).encode())
+        self.__codecs.append(codec)
+        if self.__timecontrol is not None:
+            # PLAY messages will start with the time left
+            replies.append('TIME {}'.format(self.__timecontrol).encode())
+        self.__log.log(logger.GAME, ' - Player {} ({}) ready to start ({} codec).', i, names[0] if len(names) == 1 else 'Anonymous', codec.name)
+        return True, replies
+
+    def _play(self, codec):
+        # PLAY message for the current player and the time it has to answer
+        # (None without time control)
+        start = time.perf_counter()
+        message = b'PLAY ' + self._state.encode(codec)
+        SERIALIZE_SECONDS.observe(time.perf_counter() - start, (codec.name, 'encode'))
+        timecontrol = self.__timecontrol
+        if timecontrol is None:
+            return message, None
+        clock = self.__clocks[self.currentplayer]
+        movetime = min(timecontrol.movetime if timecontrol.movetime is not None else clock, clock)
+        header = 'PLAY {:.3f} {:.3f} '.format(movetime, clock).encode()
+        timeout = movetime + timecontrol.grace if movetime != float('inf') else None
+        return header + message[len(b'PLAY '):], timeout
+
+    def _spend(self, elapsed):
+        # Charge the time taken by the current player to its clock
+        TURN_SECONDS.observe(elapsed, (str(self.currentplayer),))
+        self.__thinking[self.currentplayer] += elapsed
+        self.__clocks[self.currentplayer] = max(self.__clocks[self.currentplayer] - elapsed, 0.0)
+
+    def _forfeit(self, error):
+        # The current player ran out of time or disconnected: the next one wins
+        if isinstance(error, TimeoutError):
+            self.__log.log(logger.GAME, 'Player {} ran out of time.', self.currentplayer)
+        else:
+            self.__log.log(logger.GAME, 'Player {} disconnected: {}', self.currentplayer, error)
+        self.__forfeited = True
+        return (self.currentplayer + 1) % self.nbplayers
+
+    def _winner(self):
+        start = time.perf_counter()
+        winner = self._state.winner()
+        WINNER_SECONDS.observe(time.perf_counter() - start)
+        return winner
+
+    def _account(self, players):
+        # Count the bytes exchanged during the game
+        BYTES.inc(sum(player.sent for player in players), ('out',))
+        BYTES.inc(sum(player.received for player in players), ('in',))
+
+    def _turn(self, codec, data):
+        # Apply the move received from the current player, return the error
+        # message to send back or None
+        try:
+            start = time.perf_counter()
+            move = codec.decodemove(data)
+            decoded = time.perf_counter()
+            SERIALIZE_SECONDS.observe(decoded - start, (codec.name, 'decode'))
+            self.__log.log(logger.TURNS, '   Move: {}', move)
+            self.applymove(move)
+            APPLYMOVE_SECONDS.observe(time.perf_counter() - decoded)
+            self.__turns += 1
+            error = None
+        except InvalidMoveException as e:
+            self.__log.log(logger.GAME, 'Invalid move: {}', e)
+            INVALID_MOVES.inc(labels=(str(self.currentplayer),))
+            self.__invalid += 1
+            error = 'ERROR {}'.format(e).encode()
+        self.__log.state(logger.TURNS, '   State:', self._state)
+        return error
+
+    def _results(self, winner):
+        # Messages announcing the end of the game to each player
+        self.__duration = time.monotonic() - self.__startclock
+        self._finished(winner)
+        GAMES.inc(labels=('forfeit' if self.__forfeited else 'won' if winner is not None else 'draw',))
+        self.__log.section(logger.GAME, 'Game finished')
+        # Notify players about won/lost status
+        if winner is not None:
+            self.__log.log(logger.GAME, ' The winner is player {}.', winner)
+            return [('WON' if winner == i else 'LOST').encode() for i in range(self.nbplayers)]
+        # Notify players that the game ended
+        return [b'END'] * self.nbplayers
+
+    def _begin(self):
+        self.__started = time.time()
+        self.__startclock = time.monotonic()
+
     def _gameloop(self):
+        self._begin()
         winner = -1
-        if self.__verbose:
-            print(' Initial state:')
-            self._state.prettyprint()
+        log = self.__log
+        log.state(logger.TURNS, ' Initial state:', self._state)
+        log.flush()
         # Loop until the game ends with a winner or with a draw
         while winner == -1:
             player = self.__players[self.currentplayer]
-            if self.__verbose:
-                print("\n=> Turn #{} (player {})".format(self.turns, self.currentplayer))
-            player.sendall('PLAY {}'.format(self.state).encode())
+            log.log(logger.TURNS, '\n=> Turn #{} (player {})', self.turns, self.currentplayer)
+            codec = self.__codecs[self.currentplayer]
+            message, timeout = self._play(codec)
+            start = time.monotonic()
             try:
-                move = player.recv(self._state.__class__.buffersize()).decode()
-                if self.__verbose:
-                    print('   Move:', move)
-                self.applymove(move)
-                self.__turns += 1
-            except InvalidMoveException as e:
-                if self.__verbose:
-                    print('Invalid move:', e)
-                player.sendall('ERROR {}'.format(e).encode())
-            if self.__verbose:
-                print('   State:')
-                self._state.prettyprint()
-            winner = self._state.winner()
+                player.send(message)
+                start = time.monotonic()
+                data = player.recv(timeout)
+            except (TimeoutError, ConnectionError) as e:
+                data = e
+            self._spend(time.monotonic() - start)
+            if isinstance(data, OSError):
+                winner = self._forfeit(data)
+                break
+            error = self._turn(codec, data)
+            if error is not None:
+                try:
+                    player.send(error)
+                except ConnectionError:
+                    # Noticed when the player is asked for its next move
+                    pass
+            winner = self._winner()
             self._state.nextPlayer()
-        if self.__verbose:
-            _printsection('Game finished')
-        # Notify players about won/lost status
-        if winner is not None:
-            for i in range(self.nbplayers):
-                self.__players[i].sendall(('WON' if winner == i else 'LOST').encode())
-            if self.__verbose:
-                print(' The winner is player {}.'.format(winner))
-        # Notify players that the game ended
-        else:
-            for player in self.__players:
-                player.sendall('END'.encode())
+            log.flush()
+        for player, message in zip(self.__players, self._results(winner)):
+            try:
+                player.send(message)
+            except ConnectionError:
+                pass
+        self._account(self.__players)
         # Close the connexions with the clients
         for player in self.__players:
             player.close()
-        if self.__verbose:
-            _printsection('Game ended')
+        log.section(logger.GAME, 'Game ended')
+        log.flush()
 
     def run(self):
         if self._waitplayers():
             self._gameloop()
 
+    async def runasync(self, players):
+        '''Play a game with already connected players.
+
+        Pre: 'players' holds nbplayers AsyncConnection.
+        Post: The game has been played and the connections are closed.
+        '''
+        self.__players = players
+        self.__codecs = []
+        try:
+            # Same steps as _waitplayers and _gameloop, without blocking
+            for i, player in enumerate(players):
+                await player.send('START {}'.format(i).encode())
+                ready, replies = self._ready(i, await player.recv(HANDSHAKE_TIMEOUT))
+                if not ready:
+                    return
+                for reply in replies:
+                    await player.send(reply)
+            self._begin()
+            self.__log.flush()
+            winner = -1
+            while winner == -1:
+                player = players[self.currentplayer]
+                codec = self.__codecs[self.currentplayer]
+                message, timeout = self._play(codec)
+                start = time.monotonic()
+                try:
+                    await player.send(message)
+                    start = time.monotonic()
+                    data = await player.recv(timeout)
+                except (TimeoutError, ConnectionError) as e:
+                    data = e
+                self._spend(time.monotonic() - start)
+                if isinstance(data, OSError):
+                    winner = self._forfeit(data)
+                    break
+                error = self._turn(codec, data)
+                if error is not None:
+                    try:
+                        await player.send(error)
+                    except ConnectionError:
+                        pass
+                winner = self._winner()
+                self._state.nextPlayer()
+                self.__log.flush()
+            for player, message in zip(players, self._results(winner)):
+                try:
+                    await player.send(message)
+                except ConnectionError:
+                    pass
+        finally:
+            self.__log.flush()
+            self._account(players)
+            for player in players:
+                player.close()
+
+
+class GameLobby:
+    '''Asyncio server pairing the incoming clients into concurrent games.
+
+    'serverfactory' is called with no argument to create the GameServer of
+    each game. After 'games' games (None for no limit), the lobby stops.
+    With port 0, the port is chosen by the system (see address).
+    '''
+    def __init__(self, serverfactory, host=DEFAULT_HOST, port=DEFAULT_PORT, verbose=False, games=None):
+        self.__serverfactory = serverfactory
+        self.__host = host
+        self.__port = port
+        self.__log = logger.Logger(logger.level(verbose))
+        self.__games = games
+        # Counters of the games started and finished
+        self.started = 0
+        self.finished = 0
+        # Set once the lobby accepts connections, from its own thread
+        self.listening = threading.Event()
+        self.__address = None
+
+    @property
+    def address(self):
+        '''(host, port) the lobby listens on, None before it listens.'''
+        return self.__address
+
+    def run(self):
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+        self.__log.section(logger.GAME, 'Game server ended')
+        self.__log.flush()
+
+    async def _serve(self):
+        self.__done = asyncio.Event()
+        self.__tasks = set()
+        self.__waiting = []
+        self.__server = self.__serverfactory()
+        listener = await asyncio.start_server(self._connected, self.__host, self.__port, reuse_address=True)
+        self.__address = listener.sockets[0].getsockname()[:2]
+        self.listening.set()
+        self.__log.section(logger.GAME, 'Starting {} lobby'.format(self.__server.name))
+        self.__log.log(logger.GAME, ' Lobby listening on {}:{}.', *self.__address)
+        self.__log.flush()
+        async with listener:
+            await self.__done.wait()
+        if self.__tasks:
+            await asyncio.gather(*self.__tasks, return_exceptions=True)
+
+    async def _connected(self, reader, writer):
+        if self.__done.is_set():
+            writer.close()
+            return
+        player = AsyncConnection(reader, writer)
+        self.__waiting.append(player)
+        self.__log.log(logger.GAME, ' - Client connected from {}:{} ({}/{}).', *player.peername[:2], len(self.__waiting), self.__server.nbplayers)
+        self.__log.flush()
+        if len(self.__waiting) < self.__server.nbplayers:
+            return
+        # Enough players are waiting: start their game and prepare the next one
+        server, players = self.__server, self.__waiting
+        self.__server, self.__waiting = self.__serverfactory(), []
+        self.started += 1
+        if self.__games is not None and self.started >= self.__games:
+            # Later clients are turned away
+            self.__done.set()
+        task = asyncio.ensure_future(self._play(self.started, server, players))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    async def _play(self, number, server, players):
+        self.__log.log(logger.GAME, ' Game #{} started ({} games running).', number, self.started - self.finished)
+        self.__log.flush()
+        RUNNING_GAMES.inc()
+        try:
+            await server.runasync(players)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            GAMES.inc(labels=('aborted',))
+            self.__log.log(logger.GAME, ' Game #{} aborted: {}', number, e)
+        RUNNING_GAMES.dec()
+        self.finished += 1
+        self.__log.log(logger.GAME, ' Game #{} ended after {} turns.', number, server.turns)
+        self.__log.flush()
+
 
 class GameClient(metaclass=ABCMeta):
     '''Abstract class representing a game client'''
-    def __init__(self, server, stateclass, verbose=False):
+    def __init__(self, server, stateclass, verbose=False, codecs=None):
         self.__stateclass = stateclass
-        self.__verbose = verbose
-        if self.__verbose:
-            _printsection('Starting game')
+        self.__log = logger.Logger(logger.level(verbose))
+        # Codecs offered to the server, JSON until one has been accepted
+        self.__codecs = codecs if codecs is not None else stateclass.codecs()
+        self.__codec = JSON_CODEC
+        # (move, game) time left announced with the last PLAY, None if untimed
+        self.__timed = False
+        self._timeleft = None
+        self.__log.section(logger.GAME, 'Starting game')
         addrinfos = socket.getaddrinfo(*server, socket.AF_INET, socket.SOCK_STREAM)
         s = socket.socket()
         try:
             s.connect(addrinfos[0][4])
-            if self.__verbose:
-                print(' Connected to the game server on {}:{}.'.format(*addrinfos[0][4]))
-            self.__server = s
+            self.__log.log(logger.GAME, ' Connected to the game server on {}:{}.', *addrinfos[0][4])
+            self.__log.flush()
+            self.__server = Connection(s, stateclass.buffersize())
             self._gameloop()
         except OSError:
+            self.__log.flush()
             print(' Impossible to connect to the game server on {}:{}.'.format(*addrinfos[0][4]))
 
     def _gameloop(self):
         server = self.__server
+        log = self.__log
         running = True
         while running:
-            data = server.recv(self.__stateclass.buffersize()).decode()
-            command = data[:data.index(' ')] if ' ' in data else data
+            try:
+                message = server.recv()
+            except ConnectionError:
+                log.log(logger.GAME, ' Connection closed by the game server.')
+                log.flush()
+                server.close()
+                break
+            command, payload = _splitcommand(message)
             if command == 'START':
-                self._playernb = int(data[data.index(' '):])
-                server.sendall('READY'.encode())
-                if self.__verbose:
-                    _printsection('Game started')
-                    print("   Player's number: {}".format(self._playernb))
+                self._playernb = int(bytes(payload))
+                server.send('READY codecs={}'.format(','.join(codec.name for codec in self.__codecs)).encode())
+                log.section(logger.GAME, 'Game started')
+                log.log(logger.GAME, "   Player's number: {}", self._playernb)
+            elif command == 'CODEC':
+                self.__codec = _choosecodec(self.__codecs, [bytes(payload).decode()])
+                log.log(logger.GAME, '   Codec: {}', self.__codec.name)
+            elif command == 'TIME':
+                self.__timed = True
+                log.log(logger.GAME, '   Time control (move, game, grace): {}', bytes(payload).decode())
             elif command == 'PLAY':
-                state = self.__stateclass.parse(data[data.index(' ')+1:])
-                if self.__verbose:
-                    print("\n=> Player's turn to play")
-                    print('   State:')
-                    state.prettyprint()
+                if self.__timed:
+                    movetime, clock, payload = _splittime(payload)
+                    self._timeleft = movetime, clock
+                state = self.__codec.decodestate(self.__stateclass, payload)
+                log.log(logger.TURNS, "\n=> Player's turn to play")
+                log.state(logger.TURNS, '   State:', state)
                 move = self._nextmove(state)
-                if self.__verbose:
-                    print('   Move:', move)
-                server.sendall(move.encode())
+                log.log(logger.TURNS, '   Move: {}', move)
+                server.send(self.__codec.encodemove(move))
+                log.flush()
             elif command in ('WON', 'LOST', 'END'):
                 running = False
-                if self.__verbose:
-                    _printsection('Game finished')
-                    if command == 'WON':
-                        print(' You won the game.')
-                    elif command == 'LOST':
-                        print(' You lost the game.')
-                    else:
-                        print(' It is draw.')
-                    _printsection('Game ended')
+                log.section(logger.GAME, 'Game finished')
+                log.log(logger.GAME, ' You won the game.' if command == 'WON' else ' You lost the game.' if command == 'LOST' else ' It is draw.')
+                log.section(logger.GAME, 'Game ended')
+                log.flush()
                 server.close()
             else:
-                if self.__verbose:
-                    print('Specific data received:', data)
+                data = bytes(message).decode(errors='replace')
+                log.log(logger.GAME, 'Specific data received: {}', data)
+                log.flush()
                 self._handle(data)
 
     @abstractmethod
@@ -289,6 +908,7 @@ class GameClient(metaclass=ABCMeta):
 
         Pre: 'state' is a valid game' state.
         Post: The returned value contains a valid move to be played by this player
-              in the specified 'state' of the game.
+              in the specified 'state' of the game, as a string or in a form
+              that the game codecs encode (see Codec.encodemove).
         '''
         ...
@@ -0,0 +1,131 @@
+# gamelog.py
+# Append-only binary log of the finished Quarto games.
+
+# A log file is a header followed by one fixed-size record per game. The
+# record holds the pieces given in order and the squares they were placed
+# on: given[i] is the piece given at ply i and placements[i] the square
+# where the next player put it (NONE when the game ended before). Readers
+# memory-map the file, either to iterate over GameRecord tuples lazily or
+# to view it as a NumPy structured array (NumPy being only needed there).
+
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+from . import bitboard
+
+MAGIC = b'QLOG'
+VERSION = 1
+HEADER = struct.Struct('<4sHH')
+# start, duration, thinking time of both players, first player, result,
+# flags, invalid moves, placements, given pieces
+RECORD = struct.Struct('<dfffBBBB16s16s')
+NONE = 0xFF
+# 'result' of a game without winner
+DRAW = 2
+# 'flags' bits
+FORFEIT = 1
+# NumPy layout of a record, used by load()
+DTYPE = [
+    ('start', '<f8'), ('duration', '<f4'), ('thinking', '<f4', (2,)),
+    ('first', 'u1'), ('result', 'u1'), ('flags', 'u1'), ('invalid', 'u1'),
+    ('placements', 'u1', (bitboard.NB_SQUARES,)), ('given', 'u1', (bitboard.NB_PIECES,))
+]
+
+GameRecord = namedtuple('GameRecord', 'start duration thinking first result flags invalid placements given')
+
+
+def moves(record):
+    '''Return the (pos, piece) bitboard moves of a game record, in order.'''
+    result = []
+    for ply in range(bitboard.NB_PIECES + 1):
+        pos = record.placements[ply - 1] if ply > 0 else NONE
+        piece = record.given[ply] if ply < bitboard.NB_PIECES else NONE
+        if ply > 0 and pos == NONE:
+            break
+        result.append((-1 if pos == NONE else pos, -1 if piece == NONE else piece))
+        if piece == NONE:
+            break
+    return result
+
+
+class GameLogWriter:
+    '''Append finished games to a log file, creating it if needed.
+
+    An existing file must be a log of this version. A record left
+    incomplete by a crash is dropped, so that appends stay aligned.
+    '''
+    def __init__(self, path):
+        self._file = open(path, 'a+b')
+        header = HEADER.pack(MAGIC, VERSION, RECORD.size)
+        size = os.fstat(self._file.fileno()).st_size
+        self._file.seek(0)
+        data = self._file.read(HEADER.size)
+        if len(data) < HEADER.size and header.startswith(data):
+            # New file, or crash while writing the header
+            self._file.truncate(0)
+            self._file.write(header)
+            self._file.flush()
+        elif data != header:
+            self._file.close()
+            raise ValueError('{} is not a version {} game log'.format(path, VERSION))
+        elif (size - HEADER.size) % RECORD.size:
+            self._file.truncate(size - (size - HEADER.size) % RECORD.size)
+
+    def close(self):
+        self._file.close()
+
+    def append(self, start, duration, thinking, first, result, flags, invalid, moves):
+        '''Write the record of a game made of the (pos, piece) bitboard 'moves'.'''
+        placements = bytearray([NONE]) * bitboard.NB_SQUARES
+        given = bytearray([NONE]) * bitboard.NB_PIECES
+        for ply, (pos, piece) in enumerate(moves):
+            if pos != -1:
+                placements[ply - 1] = pos
+            if piece != -1:
+                given[ply] = piece
+        self._file.write(RECORD.pack(
+            start, duration, thinking[0], thinking[1], first, DRAW if result is None else result,
+            flags, min(invalid, 255), bytes(placements), bytes(given)
+        ))
+        # One write per game, complete records survive a crash of the server
+        self._file.flush()
+
+
+def _open(path):
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size < HEADER.size:
+            raise ValueError('{} is not a game log'.format(path))
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, size = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or size != RECORD.size:
+        data.close()
+        raise ValueError('{} is not a version {} game log'.format(path, VERSION))
+    return data
+
+
+def read(path):
+    '''Generate the GameRecord of the games of a log lazily.'''
+    data = _open(path)
+    try:
+        count = (len(data) - HEADER.size) // RECORD.size
+        view = memoryview(data)[HEADER.size:HEADER.size + count * RECORD.size]
+        try:
+            for start, duration, thinking0, thinking1, *fields in RECORD.iter_unpack(view):
+                yield GameRecord(start, duration, (thinking0, thinking1), *fields)
+        finally:
+            view.release()
+    finally:
+        data.close()
+
+
+def load(path):
+    '''Return the games of a log as a read-only NumPy structured array
+    mapping the file (see DTYPE).'''
+    import numpy as np
+    _open(path).close()
+    count = (os.path.getsize(path) - HEADER.size) // RECORD.size
+    if count == 0:
+        return np.zeros(0, dtype=DTYPE)
+    return np.memmap(path, dtype=DTYPE, mode='r', offset=HEADER.size, shape=(count,))
@@ -0,0 +1,65 @@
+# logger.py
+# Level-gated verbose output of the game servers and clients.
+
+# Messages are kept as a format string and its arguments, and only formatted
+# when the logger is flushed, so that a disabled level costs a comparison and
+# nothing else. The pending lines are written to the stream at once by
+# flush(), which the game loops call once per turn.
+
+import sys
+
+# Levels, each one including the previous ones
+OFF = 0
+# Connections, start and result of the games
+GAME = 1
+# Moves and states of every turn
+TURNS = 2
+SECTION_WIDTH = 60
+
+
+def level(verbose):
+    '''Return the level of a 'verbose' flag, which may also be a level.'''
+    if verbose is True:
+        return TURNS
+    return int(verbose or OFF)
+
+
+class Logger:
+    '''Buffered output of the messages up to a level.
+
+    'stream' is the file written by flush(), sys.stdout (looked up at each
+    flush) by default.
+    '''
+    def __init__(self, level=OFF, stream=None):
+        self.level = level
+        self._stream = stream
+        self._pending = []
+
+    def enabled(self, level):
+        return level <= self.level
+
+    def log(self, level, message, *args):
+        '''Add a line, formatted with 'args' when flushed.'''
+        if level <= self.level:
+            self._pending.append((message, args))
+
+    def section(self, level, title):
+        '''Add a section title line, preceded by an empty line.'''
+        if level <= self.level:
+            self._pending.append(('\n{}', (' {} '.format(title).center(SECTION_WIDTH, '='),)))
+
+    def state(self, level, title, state):
+        '''Add a line with 'title' followed by the rendering of 'state'.'''
+        if level <= self.level:
+            # Rendered now, the state changes before the next flush
+            self._pending.append(('{}\n{}', (title, state.render().rstrip('\n'))))
+
+    def flush(self):
+        '''Write the pending lines with a single write.'''
+        if not self._pending:
+            return
+        text = '\n'.join(message.format(*args) for message, args in self._pending) + '\n'
+        self._pending.clear()
+        stream = self._stream if self._stream is not None else sys.stdout
+        stream.write(text)
+        stream.flush()
@@ -0,0 +1,212 @@
+# mcts.py
+# Monte Carlo Tree Search engine for the Quarto game.
+
+# The tree uses UCT selection over the same (pos, piece) moves as the
+# alpha-beta engine, only giving unsafe pieces when no safe one is left.
+# Playouts are random games on the bitboard, that never give away a quarto
+# when a safe piece exists. With several workers, each process of a pool
+# grows its own tree from the root for the whole time budget and the visit
+# counts of the root moves are summed (root parallelism).
+
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from . import bitboard
+
+DEFAULT_EXPLORATION = 1.4
+# Time kept for the pool to send the trees statistics back
+POOL_MARGIN = 0.05
+
+
+class TreeResult:
+    '''Outcome of a tree search: most visited move and statistics.'''
+    def __init__(self, move, visits, winrate, playouts, elapsed):
+        self.move = move
+        self.visits = visits
+        self.winrate = winrate
+        self.playouts = playouts
+        self.elapsed = elapsed
+
+    @property
+    def nodes(self):
+        return self.playouts
+
+    @property
+    def nps(self):
+        return self.playouts / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return 'TreeResult(move={}, visits={}, winrate={:.3f}, playouts={}, nps={:.0f})'.format(
+            self.move, self.visits, self.winrate, self.playouts, self.nps
+        )
+
+
+class _Node:
+    __slots__ = ('move', 'parent', 'children', 'untried', 'visits', 'wins')
+
+    def __init__(self, move, parent, untried):
+        self.move = move
+        self.parent = parent
+        self.children = []
+        self.untried = untried
+        self.visits = 0
+        # Sum of the rewards of the player who played 'move'
+        self.wins = 0.0
+
+
+def _moves(board):
+    '''Return the moves worth trying on 'board', [] if the game is over.'''
+    piece = board.piece
+    if piece != -1 and board.winningsquares(piece):
+        return []
+    # A move giving an unsafe piece is only kept when all of them do
+    return list(board.moves((bitboard.SAFE,))) or list(islice(board.moves((bitboard.UNSAFE,)), 1))
+
+
+def playout(board, rnd=random):
+    '''Play a random game from 'board' and undo it.
+
+    Pre: -
+    Post: The returned value is 1 if the player to move on 'board' won,
+          -1 if it lost and 0 for a draw. 'board' is left unchanged.
+    '''
+    sign = 1
+    plies = 0
+    while True:
+        piece = board.piece
+        if piece != -1:
+            if board.winningsquares(piece):
+                result = sign
+                break
+            free = [pos for pos in range(bitboard.NB_SQUARES) if not board.occupied >> pos & 1]
+            pos = free[rnd.randrange(len(free))]
+        elif board.occupied == bitboard.FULL:
+            result = 0
+            break
+        else:
+            pos = -1
+        board.push(pos, -1)
+        remaining = board.remaining
+        pieces = bitboard.piecelist(board.safepieces() or remaining)
+        board.pop()
+        board.push(pos, pieces[rnd.randrange(len(pieces))] if pieces else -1)
+        plies += 1
+        sign = -sign
+    for _ in range(plies):
+        board.pop()
+    return result
+
+
+class _Tree:
+    def __init__(self, board, exploration, rnd):
+        self.board = board.copy()
+        self.exploration = exploration
+        self.rnd = rnd
+        self.root = _Node(None, None, _moves(self.board))
+        self.playouts = 0
+
+    def run(self, deadline):
+        board = self.board
+        rnd = self.rnd
+        c = self.exploration
+        # Always run a first batch so that the root has statistics
+        while True:
+            for _ in range(16):
+                node = self.root
+                plies = 0
+                # Selection
+                while not node.untried and node.children:
+                    logvisits = math.log(node.visits)
+                    node = max(node.children, key=lambda child: child.wins / child.visits + c * math.sqrt(logvisits / child.visits))
+                    board.push(*node.move)
+                    plies += 1
+                # Expansion
+                if node.untried:
+                    move = node.untried.pop(rnd.randrange(len(node.untried)))
+                    board.push(*move)
+                    plies += 1
+                    child = _Node(move, node, _moves(board))
+                    node.children.append(child)
+                    node = child
+                # Simulation, from the point of view of the player to move
+                result = playout(board, rnd)
+                self.playouts += 1
+                for _ in range(plies):
+                    board.pop()
+                # Backpropagation, the player to move alternating on the way up
+                while node is not None:
+                    node.visits += 1
+                    node.wins += (1 - result) / 2
+                    result = -result
+                    node = node.parent
+            if time.monotonic() >= deadline:
+                break
+
+    def rootstats(self):
+        return {child.move: (child.visits, child.wins) for child in self.root.children}
+
+
+def _searchtree(board, timelimit, exploration, seed):
+    tree = _Tree(board, exploration, random.Random(seed))
+    tree.run(time.monotonic() + timelimit)
+    return tree.rootstats(), tree.playouts
+
+
+class MonteCarloSearcher:
+    '''UCT search with random playouts, spread over 'workers' processes.
+
+    'timelimit' is the wall-clock budget of a search in seconds. With a
+    single worker the tree is grown in the calling process.
+    '''
+    def __init__(self, timelimit=1.0, workers=None, exploration=DEFAULT_EXPLORATION):
+        self.timelimit = timelimit
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.exploration = exploration
+        self._pool = None
+
+    def close(self):
+        '''Shut the process pool down.'''
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def search(self, board):
+        '''Search the best move for the player to move on 'board'.
+
+        Pre: The game on 'board' is not over.
+        Post: The returned TreeResult holds the most visited root move.
+              'board' is left unchanged.
+        '''
+        start = time.monotonic()
+        piece = board.piece
+        if piece != -1:
+            winning = board.winningsquares(piece)
+            if winning:
+                return TreeResult(next(board.moves((bitboard.WINNING,))), 0, 1.0, 0, time.monotonic() - start)
+
+        seed = random.getrandbits(32)
+        if self.workers <= 1:
+            results = [_searchtree(board, self.timelimit, self.exploration, seed)]
+        else:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            budget = max(self.timelimit - POOL_MARGIN, POOL_MARGIN)
+            futures = [
+                self._pool.submit(_searchtree, board, budget, self.exploration, seed + i)
+                for i in range(self.workers)
+            ]
+            results = [future.result() for future in futures]
+
+        stats = {}
+        playouts = 0
+        for rootstats, count in results:
+            playouts += count
+            for move, (visits, wins) in rootstats.items():
+                total = stats.get(move, (0, 0.0))
+                stats[move] = (total[0] + visits, total[1] + wins)
+        move, (visits, wins) = max(stats.items(), key=lambda item: item[1][0])
+        return TreeResult(move, visits, wins / visits if visits else 0.0, playouts, time.monotonic() - start)
@@ -0,0 +1,160 @@
+# metrics.py
+# Counters and histograms of the game servers, exported in the Prometheus
+# text format.
+
+# The metrics are module-level objects of a process-wide registry that the
+# servers update as they go, with a few integer and float operations per
+# observation. MetricsServer serves the registry over HTTP on /metrics, from
+# a daemon thread, so that it works along the blocking server and the lobby.
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9100
+# Network round trips, in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Computations of the server, in seconds
+CPU_BUCKETS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.01)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, value) for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    '''Monotonic count, one per combination of label values.'''
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, amount=1, labels=()):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for values, value in list(self._values.items()):
+            yield self.name + _labels(self.labels, values), value
+
+
+class Gauge(Counter):
+    '''Value going up and down, one per combination of label values.'''
+    kind = 'gauge'
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+    def set(self, value, labels=()):
+        self._values[labels] = value
+
+
+class Histogram:
+    '''Distribution of observed values over fixed buckets.'''
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # Per label values: [count of each bucket and of +Inf, sum]
+        self._values = {}
+
+    def observe(self, value, labels=()):
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+
+    def count(self, labels=()):
+        data = self._values.get(labels)
+        return sum(data[0]) if data is not None else 0
+
+    def samples(self):
+        names = self.labels + ('le',)
+        for values, (counts, total) in list(self._values.items()):
+            counts = list(counts)
+            cumulated = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulated += count
+                yield self.name + '_bucket' + _labels(names, values + (bound,)), cumulated
+            yield self.name + '_sum' + _labels(self.labels, values), total
+            yield self.name + '_count' + _labels(self.labels, values), cumulated
+
+
+class Registry:
+    '''Set of metrics rendered together.'''
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, labels=()):
+        return self.register(Histogram(name, help, buckets, labels))
+
+    def render(self):
+        '''Return the metrics in the Prometheus text exposition format.'''
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, value in metric.samples():
+                lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class MetricsServer:
+    '''HTTP endpoint serving a registry on /metrics from a daemon thread.'''
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, registry=REGISTRY):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,185 @@
+# search.py
+# Alpha-beta search engine for the Quarto game.
+
+# A move is a (pos, piece) pair: the piece to play is placed on 'pos' (-1 on
+# the first move of the game, when there is none yet) and 'piece' is given to
+# the opponent (-1 once no piece is left). Scores are seen from the player to
+# move: WIN - ply for a quarto made at 'ply', 0 for a draw or an unknown
+# outcome at the search horizon.
+
+import time
+from itertools import chain
+
+from . import bitboard
+from . import transposition
+
+WIN = 100
+INFINITY = 1000
+# Scores beyond this bound are quartos, stored relatively to the node in the table
+MATE_BOUND = WIN - bitboard.NB_SQUARES - 1
+# Number of nodes between two checks of the clock
+CHECK_INTERVAL = 1024
+
+
+class SearchTimeout(Exception):
+    '''Exception raised inside the search when its time budget is spent.'''
+    pass
+
+
+def _issafe(board, move):
+    # Whether a move (from the table, so maybe from another position) is a
+    # legal move giving a safe piece
+    pos, piece = move
+    if pos == -1 and board.piece != -1 or pos != -1 and (board.piece == -1 or not board.isfree(pos)):
+        return False
+    board.push(pos, -1)
+    remaining = board.remaining
+    safe = board.safepieces()
+    board.pop()
+    return piece == -1 and not remaining or piece != -1 and safe >> piece & 1 == 1
+
+
+class SearchResult:
+    '''Outcome of a search: best move, score and statistics.'''
+    def __init__(self, move, score, depth, nodes, elapsed):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+    @property
+    def nps(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def proven(self):
+        '''Whether the score is an exact win or loss rather than a horizon guess.'''
+        return abs(self.score) >= MATE_BOUND
+
+    def __repr__(self):
+        return 'SearchResult(move={}, score={}, depth={}, nodes={}, nps={:.0f})'.format(
+            self.move, self.score, self.depth, self.nodes, self.nps
+        )
+
+
+class Searcher:
+    '''Negamax search with alpha-beta pruning and iterative deepening.
+
+    'timelimit' is the wall-clock budget of a search in seconds and
+    'maxdepth' an optional bound on the depth in plies. The transposition
+    'table' is kept across searches; a default sized one is created if None.
+    '''
+    def __init__(self, timelimit=1.0, maxdepth=None, table=None):
+        self.timelimit = timelimit
+        self.maxdepth = maxdepth
+        self.table = table if table is not None else transposition.TranspositionTable()
+        self.nodes = 0
+
+    def search(self, board):
+        '''Search the best move for the player to move on 'board'.
+
+        Pre: The game on 'board' is not over.
+        Post: The returned SearchResult holds the best move of the deepest
+              completed iteration. 'board' is left unchanged.
+        '''
+        board = board.copy()
+        start = time.monotonic()
+        self._deadline = start + self.timelimit
+        self.nodes = 0
+        self.table.newsearch()
+        empty = bitboard.NB_SQUARES - bin(board.occupied).count('1')
+        maxdepth = empty if self.maxdepth is None else min(self.maxdepth, empty)
+        result = None
+        for depth in range(1, max(maxdepth, 1) + 1):
+            # The first iteration always completes so that a move is known
+            self._timed = result is not None
+            self._rootmove = result.move if result is not None else None
+            try:
+                score = self._negamax(board, depth, -INFINITY, INFINITY, 0)
+            except SearchTimeout:
+                break
+            result = SearchResult(self._bestmove, score, depth, self.nodes, time.monotonic() - start)
+            if result.proven:
+                break
+        result.nodes = self.nodes
+        result.elapsed = time.monotonic() - start
+        return result
+
+    def _negamax(self, board, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self._timed and self.nodes % CHECK_INTERVAL == 0 and time.monotonic() > self._deadline:
+            raise SearchTimeout()
+
+        piece = board.piece
+        if piece == -1:
+            if board.occupied == bitboard.FULL:
+                # The board is full without a quarto
+                return 0
+        else:
+            winning = board.winningsquares(piece)
+            if winning:
+                if ply == 0:
+                    # The game ends but a next piece is still part of the move
+                    self._bestmove = next(board.moves((bitboard.WINNING,)))
+                return WIN - ply
+            if depth == 0:
+                return 0
+
+        first = self._rootmove if ply == 0 else None
+        entry = self.table.probe(board.hash)
+        if entry is not None:
+            score, entrydepth, bound, move = entry
+            if entrydepth >= depth and ply > 0:
+                if score >= MATE_BOUND:
+                    score -= ply
+                elif score <= -MATE_BOUND:
+                    score += ply
+                if bound == transposition.EXACT:
+                    return score
+                if bound == transposition.LOWER and score >= beta:
+                    return score
+                if bound == transposition.UPPER and score <= alpha:
+                    return score
+            first = move
+        if first is not None and not _issafe(board, first):
+            first = None
+        origalpha = alpha
+
+        # Moves giving an unsafe piece lose at once: they are only looked at
+        # when there is no safe move at all
+        moves = board.moves((bitboard.SAFE,))
+        if first is not None:
+            moves = chain((first,), (move for move in moves if move != first))
+        best = -INFINITY
+        bestmove = None
+        for move in moves:
+            board.push(*move)
+            score = -self._negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            board.pop()
+            if score > best:
+                best = score
+                bestmove = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        if bestmove is None:
+            best = -(WIN - ply - 1)
+            bestmove = next(board.moves((bitboard.UNSAFE,)))
+
+        if ply == 0:
+            self._bestmove = bestmove
+        if best <= origalpha:
+            bound = transposition.UPPER
+        elif best >= beta:
+            bound = transposition.LOWER
+        else:
+            bound = transposition.EXACT
+        stored = best
+        if best >= MATE_BOUND:
+            stored += ply
+        elif best <= -MATE_BOUND:
+            stored -= ply
+        self.table.store(board.hash, stored, depth, bound, bestmove)
+        return best
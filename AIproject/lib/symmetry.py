@@ -0,0 +1,158 @@
+# symmetry.py
+# Symmetries of the Quarto positions.
+
+# A position keeps its value when the squares are permuted so that lines
+# stay lines (rotations, reflections and the inner/outer swaps, 32 in all),
+# when the four attributes are relabelled (24 permutations) and when some
+# attributes have their two values swapped (16 complements). canonical()
+# picks a unique representative among those 12288 images of a position.
+
+from itertools import permutations
+
+from . import bitboard
+
+NB_SQUARES = bitboard.NB_SQUARES
+
+
+def _geometries():
+    # Square permutations g where the image square j holds the square g[j]
+    def compose(a, b):
+        return tuple(a[b[j]] for j in range(NB_SQUARES))
+
+    def rowcol(order):
+        return tuple(4 * order[j // 4] + order[j % 4] for j in range(NB_SQUARES))
+
+    generators = (
+        tuple(4 * (3 - j % 4) + j // 4 for j in range(NB_SQUARES)),  # rotation
+        tuple(4 * (j // 4) + 3 - j % 4 for j in range(NB_SQUARES)),  # reflection
+        rowcol((1, 0, 3, 2)),                                      # inner/outer swap
+        rowcol((0, 2, 1, 3))                                       # middle swap
+    )
+    identity = tuple(range(NB_SQUARES))
+    found = [identity]
+    seen = {identity}
+    for g in found:
+        for generator in generators:
+            h = compose(g, generator)
+            if h not in seen:
+                seen.add(h)
+                found.append(h)
+    lines = {frozenset(line) for line in bitboard.LINES}
+    assert all({frozenset(g[j] for j in line) for line in bitboard.LINES} == lines for g in found)
+    return tuple(found)
+
+
+GEOMETRIES = _geometries()
+GEOMETRY_INVERSES = tuple(
+    tuple(g.index(pos) for pos in range(NB_SQUARES))
+    for g in GEOMETRIES
+)
+# Occupancy mask images, split in two byte tables per geometry
+GEOMETRY_MASKS = tuple(
+    tuple(
+        tuple(sum(1 << inverse[8 * half + b] for b in range(8) if byte >> b & 1) for byte in range(256))
+        for half in range(2)
+    )
+    for inverse in GEOMETRY_INVERSES
+)
+
+ATTRIBUTE_PERMUTATIONS = tuple(permutations(range(len(bitboard.ATTRIBUTES))))
+# Piece images without complement; the 17th entry maps the empty square -1 to itself
+PIECE_PERMUTATIONS = tuple(
+    tuple(sum((p >> perm[b] & 1) << b for b in range(len(perm))) for p in range(bitboard.NB_PIECES)) + (-1,)
+    for perm in ATTRIBUTE_PERMUTATIONS
+)
+PIECE_PERMUTATION_INVERSES = tuple(
+    tuple(table.index(p) for p in range(bitboard.NB_PIECES)) + (-1,)
+    for table in PIECE_PERMUTATIONS
+)
+
+
+class Symmetry:
+    '''Symmetry of the Quarto positions: a geometry of the squares, a
+    permutation of the attributes and a complement mask, all as indexes.'''
+    def __init__(self, geometry=0, attributes=0, complement=0):
+        self.geometry = geometry
+        self.attributes = attributes
+        self.complement = complement
+
+    def square(self, pos):
+        '''Image of a square, -1 being kept for a missing position.'''
+        return GEOMETRY_INVERSES[self.geometry][pos] if pos != -1 else -1
+
+    def piece(self, piece):
+        '''Image of a piece, -1 being kept for a missing piece.'''
+        return PIECE_PERMUTATIONS[self.attributes][piece] ^ self.complement if piece != -1 else -1
+
+    def apply(self, move):
+        '''Image of a (pos, piece) move.'''
+        return self.square(move[0]), self.piece(move[1])
+
+    def revert(self, move):
+        '''Preimage of a (pos, piece) move, the inverse of apply().'''
+        pos, piece = move
+        if pos != -1:
+            pos = GEOMETRIES[self.geometry][pos]
+        if piece != -1:
+            piece = PIECE_PERMUTATION_INVERSES[self.attributes][piece ^ self.complement]
+        return pos, piece
+
+    def transform(self, board):
+        '''Return a new board, image of 'board' by this symmetry.'''
+        image = bitboard.Board()
+        image.remaining = 0
+        for pos, piece in enumerate(board.squares):
+            if piece != -1:
+                image._set(self.square(pos), self.piece(piece))
+        for piece in bitboard.piecelist(board.remaining):
+            image.remaining |= 1 << self.piece(piece)
+        image.piece = self.piece(board.piece)
+        image.hash = image.zobrist()
+        return image
+
+    def __repr__(self):
+        return 'Symmetry({}, {}, {})'.format(self.geometry, self.attributes, self.complement)
+
+
+def canonical(board):
+    '''Map a position to its canonical representative.
+
+    Pre: -
+    Post: The returned value is a (key, symmetry) pair where 'key' is an
+          integer identifying the representative of 'board' (equal for all
+          its symmetric positions) and 'symmetry' maps 'board' onto it.
+    '''
+    # The representative has the smallest image of the occupancy mask...
+    occupied = board.occupied
+    low, high = occupied & 0xFF, occupied >> 8
+    best = None
+    geometries = []
+    for g, (lowtable, hightable) in enumerate(GEOMETRY_MASKS):
+        mask = lowtable[low] | hightable[high]
+        if best is None or mask < best:
+            best = mask
+            geometries = [g]
+        elif mask == best:
+            geometries.append(g)
+
+    # ...then the smallest sequence of pieces, the piece to play last. For
+    # a given relabelling, the complement turning the first piece of the
+    # sequence into 0 always gives the smallest sequence.
+    squares = board.squares
+    bestkey = None
+    for g in geometries:
+        geometry = GEOMETRIES[g]
+        sequence = [squares[pos] for pos in geometry]
+        sequence.append(board.piece)
+        first = next((p for p in sequence if p != -1), -1)
+        for a, table in enumerate(PIECE_PERMUTATIONS):
+            complement = table[first] if first != -1 else 0
+            key = 0
+            for p in sequence:
+                key <<= 5
+                if p != -1:
+                    key |= (table[p] ^ complement) + 1
+            if bestkey is None or key < bestkey:
+                bestkey = key
+                symmetry = (g, a, complement)
+    return bestkey, Symmetry(*symmetry)
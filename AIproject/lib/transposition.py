@@ -0,0 +1,99 @@
+# transposition.py
+# Fixed-size transposition table for the Quarto search engines.
+
+# The table is made of two-entry buckets indexed by the low bits of the
+# Zobrist hash. The first entry of a bucket is depth-preferred: it is only
+# replaced by a deeper search of any position or by an entry of a newer
+# search. The second one always takes the new entry otherwise. Entries live
+# in two flat arrays (full 64-bit keys and packed data), so the memory used
+# is fixed when the table is created.
+
+from array import array
+
+EXACT, LOWER, UPPER = 1, 2, 3
+ENTRY_SIZE = 16
+DEFAULT_MEGABYTES = 16
+
+# Layout of the packed data: score, depth, bound, move and search generation
+_SCORE_OFFSET = 1 << 10
+_DEPTH_SHIFT = 11
+_BOUND_SHIFT = 16
+_POS_SHIFT = 18
+_PIECE_SHIFT = 23
+_GENERATION_SHIFT = 28
+
+
+class TranspositionTable:
+    '''Bounded transposition table.
+
+    'megabytes' caps the memory used by the entries; the number of buckets
+    is the largest power of two that fits in it.
+    '''
+    def __init__(self, megabytes=DEFAULT_MEGABYTES):
+        entries = max(2, megabytes * 2 ** 20 // ENTRY_SIZE)
+        buckets = 1 << (entries // 2).bit_length() - 1
+        self._mask = buckets - 1
+        self._keys = array('Q', bytes(8 * 2 * buckets))
+        self._data = array('q', bytes(8 * 2 * buckets))
+        self._generation = 1
+        self.hits = 0
+        self.stores = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def megabytes(self):
+        return len(self) * ENTRY_SIZE / 2 ** 20
+
+    def newsearch(self):
+        '''Age the entries so that the ones of previous searches get replaced first.'''
+        self._generation = self._generation % 255 + 1
+
+    def clear(self):
+        self._keys = array('Q', bytes(8 * len(self._keys)))
+        self._data = array('q', bytes(8 * len(self._data)))
+        self._generation = 1
+
+    def probe(self, key):
+        '''Return the (score, depth, bound, move) entry of 'key', None if absent.'''
+        index = (key & self._mask) << 1
+        keys = self._keys
+        if keys[index] == key:
+            data = self._data[index]
+        elif keys[index + 1] == key:
+            data = self._data[index + 1]
+        else:
+            return None
+        if data == 0:
+            return None
+        self.hits += 1
+        return (
+            (data & 0x7FF) - _SCORE_OFFSET,
+            data >> _DEPTH_SHIFT & 0x1F,
+            data >> _BOUND_SHIFT & 0x3,
+            ((data >> _POS_SHIFT & 0x1F) - 1, (data >> _PIECE_SHIFT & 0x1F) - 1)
+        )
+
+    def store(self, key, score, depth, bound, move):
+        '''Store a search result, 'move' being a (pos, piece) pair or None.'''
+        pos, piece = move if move is not None else (-1, -1)
+        data = (
+            score + _SCORE_OFFSET
+            | depth << _DEPTH_SHIFT
+            | bound << _BOUND_SHIFT
+            | (pos + 1) << _POS_SHIFT
+            | (piece + 1) << _PIECE_SHIFT
+            | self._generation << _GENERATION_SHIFT
+        )
+        index = (key & self._mask) << 1
+        keys = self._keys
+        old = self._data[index]
+        if (keys[index] == key or old == 0 or depth >= (old >> _DEPTH_SHIFT & 0x1F)
+                or (old >> _GENERATION_SHIFT) != self._generation):
+            slot = index
+        else:
+            slot = index + 1
+        keys[slot] = key
+        self._data[slot] = data
+        self.stores += 1
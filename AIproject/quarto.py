@@ -4,14 +4,30 @@
 # Version: May 17, 2018
 
 import argparse
+import os
 import socket
 import sys
 import random
 import json
-import copy
-import re
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 from lib import game
+from lib import bitboard
+from lib import book
+from lib import endgame
+from lib import gamelog
+from lib import mcts
+from lib import metrics
+from lib import search
+from lib import symmetry
+from lib import transposition
+
+# Text of a square of the board for each piece, None being a free square
+CELL_TEXT = dict([(None, ' ' * 6)] + [(piece, piece.display) for piece in bitboard.PIECES])
+BOARD_TEMPLATE = 'Board:\n' + ('|' + '{}|' * 4 + '\n') * 4
 
 class QuartoState(game.GameState):
     '''Class representing a state for the Quarto game.'''
@@ -19,835 +35,615 @@ class QuartoState(game.GameState):
         self.__player = 0
         random.seed()
         if initialstate is None:
-            pieces = []
-            for shape in ['round', 'square']:
-                for color in ['dark', 'light']:
-                    for height in ['low', 'high']:
-                        for filling in ['empty', 'full']:
-                            pieces.append({
-                                'shape': shape,
-                                'color': color,
-                                'height': height,
-                                'filling': filling
-                            })
             initialstate = {
                 'board': [None] * 16,
-                'remainingPieces': pieces,
+                'remainingPieces': list(bitboard.PIECES),
                 'pieceToPlay': None,
                 'quartoAnnounced': False
             }
+        else:
+            # Pieces are shared bitboard.Piece singletons, not dicts
+            topiece = bitboard.topiece
+            initialstate = dict(
+                initialstate,
+                board=[None if piece is None else topiece(piece) for piece in initialstate['board']],
+                remainingPieces=[topiece(piece) for piece in initialstate['remainingPieces']]
+            )
 
         if currentPlayer is None:
             currentPlayer = random.randrange(2)
 
         super().__init__(initialstate, currentPlayer=currentPlayer)
-
-    def applymove(self, move):
+        self._board = bitboard.Board.fromvisible(self._state['visible'])
+
+    @property
+    def board(self):
+        '''Compact bitboard of this state, kept in sync with its 'visible' part.'''
+        return self._board
+
+    def canonical(self):
+        '''Return the (key, symmetry) pair of the canonical representative of
+        this position among its symmetric ones (see lib/symmetry.py).'''
+        return symmetry.canonical(self._board)
+
+    def checkmove(self, move):
+        '''Check a move without applying it.
+
+        Pre: -
+        Post: The returned value is the (pos, piece) bitboard form of 'move',
+              with -1 for a missing position or next piece.
+        Raises InvalidMoveException: If 'move' is invalid in this state.
+        '''
         #{pos: 8, quarto: true, nextPiece: 2}
-        stateBackup = copy.deepcopy(self._state)
-        try:
-            state = self._state['visible']
-            if state['pieceToPlay'] is not None:
-                try:
-                    if state['board'][move['pos']] is not None:
-                        raise game.InvalidMoveException('The position is not free')
-                    state['board'][move['pos']] = state['remainingPieces'][state['pieceToPlay']]
-                    del(state['remainingPieces'][state['pieceToPlay']])
-                except game.InvalidMoveException as e:
-                    raise e
-                except:
-                    raise game.InvalidMoveException("Your move should contain a \"pos\" key in range(16)")
-
-            if len(state['remainingPieces']) > 0:
-                try:
-                    state['pieceToPlay'] = move['nextPiece']
-                except:
-                    raise game.InvalidMoveException("You must specify the next piece to play")
-            else:
-                state['pieceToPlay'] = None
-
-            if 'quarto' in move:
-                state['quartoAnnounced'] = move['quarto']
-                winner = self.winner()
-                if winner is None or winner == -1:
-                    raise game.InvalidMoveException("There is no Quarto !")
-            else:
-                state['quartoAnnounced'] = False
-        except game.InvalidMoveException as e:
-            self._state = stateBackup
-            raise e
-
-
-    def _same(self, feature, elems):
-        try:
-            elems = list(map(lambda piece: piece[feature], elems))
-        except:
-            return False
-        return all(e == elems[0] for e in elems)
+        if not isinstance(move, dict):
+            raise game.InvalidMoveException('A valid move must be a JSON object')
+        board = self._board
+        pos = -1
+        remaining = board.remaining
+        if board.piece != -1:
+            pos = move.get('pos')
+            if not isinstance(pos, int) or not 0 <= pos < bitboard.NB_SQUARES:
+                raise game.InvalidMoveException("Your move should contain a \"pos\" key in range(16)")
+            if not board.isfree(pos):
+                raise game.InvalidMoveException('The position is not free')
+            remaining &= ~(1 << board.piece)
+
+        piece = -1
+        if remaining:
+            pieces = bitboard.piecelist(remaining)
+            nextPiece = move.get('nextPiece')
+            if not isinstance(nextPiece, int) or not 0 <= nextPiece < len(pieces):
+                raise game.InvalidMoveException("You must specify the next piece to play")
+            piece = pieces[nextPiece]
+
+        if 'quarto' in move:
+            board.push(pos, piece)
+            quarto = board.hasquarto()
+            board.pop()
+            if not (move['quarto'] and quarto):
+                raise game.InvalidMoveException("There is no Quarto !")
+        return pos, piece
+
+    def wiremove(self, pos, piece):
+        '''Return the JSON form of the (pos, piece) bitboard move.'''
+        board = self._board
+        move = {}
+        remaining = board.remaining
+        if pos != -1:
+            move['pos'] = pos
+            remaining &= ~(1 << board.piece)
+        if piece != -1:
+            move['nextPiece'] = bin(remaining & ((1 << piece) - 1)).count('1')
+        return move
+
+    def legalmoves(self, order=bitboard.MOVE_ORDER):
+        '''Generate the legal (pos, nextPiece) moves lazily in their wire form,
+        None standing for a missing key (see Board.moves() for 'order').'''
+        for pos, piece in self._board.moves(order):
+            move = self.wiremove(pos, piece)
+            yield move.get('pos'), move.get('nextPiece')
 
-    def _quarto(self, elems):
-        return self._same('shape', elems) or self._same('color', elems) or self._same('filling', elems) or self._same('height', elems)
+    def applymove(self, move):
+        '''Apply a move.
+
+        Pre: -
+        Post: The returned value is the (pos, piece) bitboard form of the
+              applied 'move'.
+        Raises InvalidMoveException: If 'move' is invalid in this state.
+        '''
+        pos, piece = self.checkmove(move)
+        state = self._state['visible']
+        if pos != -1:
+            state['board'][pos] = state['remainingPieces'].pop(state['pieceToPlay'])
+        state['pieceToPlay'] = move['nextPiece'] if piece != -1 else None
+        state['quartoAnnounced'] = move['quarto'] if 'quarto' in move else False
+        self._board.push(pos, piece)
+        self._changed()
+        return pos, piece
 
     def winner(self):
         state = self._state['visible']
-        board = state['board']
         player = self._state['currentPlayer']
-
-        # 00 01 02 03
-        # 04 05 06 07
-        # 08 09 10 11
-        # 12 13 14 15
-
-        if state['quartoAnnounced']:
-            # Check horizontal and vertical lines
-            for i in range(4):
-                if self._quarto([board[4 * i + e] for e in range(4)]):
-                    return player
-                if self._quarto([board[4 * e + i] for e in range(4)]):
-                    return player
-            # Check diagonals
-            if self._quarto([board[5 * e] for e in range(4)]):
-                return player
-            if self._quarto([board[3 + 3 * e] for e in range(4)]):
-                return player
-        return None if board.count(None) == 0 else -1
+        if state['quartoAnnounced'] and self._board.hasquarto():
+            return player
+        return None if self._board.isfull() else -1
 
     def displayPiece(self, piece):
-        if piece is None:
-            return " " * 6
-        bracket = ('(', ')') if piece['shape'] == "round" else ('[', ']')
-        filling = 'E' if piece['filling'] == 'empty' else 'F'
-        color = 'L' if piece['color'] == 'light' else 'D'
-        format = ' {}{}{}{} ' if piece['height'] == 'low' else '{0}{0}{1}{2}{3}{3}'
-        return format.format(bracket[0], filling, color, bracket[1])
+        return CELL_TEXT[bitboard.topiece(piece) if piece is not None else None]
 
-    def prettyprint(self):
+    def render(self):
         state = self._state['visible']
-
-        print('Board:')
-        for row in range(4):
-            print('|', end="")
-            for col in range(4):
-                print(self.displayPiece(state['board'][row*4+col]), end="|")
-            print()
-
-        print('\nRemaining Pieces:')
-        print(", ".join([self.displayPiece(piece) for piece in state['remainingPieces']]))
-
+        text = BOARD_TEMPLATE.format(*[CELL_TEXT[piece] for piece in state['board']])
+        text += '\nRemaining Pieces:\n' + ', '.join([CELL_TEXT[piece] for piece in state['remainingPieces']]) + '\n'
         if state['pieceToPlay'] is not None:
-            print('\nPiece to Play:')
-            print(self.displayPiece(state['remainingPieces'][state['pieceToPlay']]))
+            text += '\nPiece to Play:\n' + CELL_TEXT[state['remainingPieces'][state['pieceToPlay']]] + '\n'
+        return text
+
+    def prettyprint(self):
+        sys.stdout.write(self.render())
 
     def nextPlayer(self):
         self._state['currentPlayer'] = (self._state['currentPlayer'] + 1) % 2
+        self._changed()
 
+    def _serialize(self):
+        # Same text as json.dumps, from the JSON forms kept by the pieces
+        state = self._state['visible']
+        return '{{"visible":{{"board":[{}],"remainingPieces":[{}],"pieceToPlay":{},"quartoAnnounced":{}}},"currentPlayer":{}}}'.format(
+            ','.join('null' if piece is None else piece.json for piece in state['board']),
+            ','.join(piece.json for piece in state['remainingPieces']),
+            json.dumps(state['pieceToPlay']), json.dumps(state['quartoAnnounced']),
+            json.dumps(self._state['currentPlayer'])
+        )
+
+    @classmethod
+    def codecs(cls):
+        return (QUARTO_CODEC, game.JSON_CODEC)
+
+
+class QuartoCodec(game.Codec):
+    '''Binary encoding of the Quarto states (11 bytes) and moves (2 bytes).
+
+    A state is the 16-bit occupancy mask, the 16 squares as 4-bit pieces and
+    a byte holding the piece to play (or NO_PIECE), the current player and
+    the quartoAnnounced flag. The remaining pieces are the ones that are not
+    on the board, in increasing order as in the JSON state. A move is the
+    position (or NONE) and the index of the next piece (or NONE) with the
+    QUARTO flag.
+    '''
+    name = 'quarto'
+    STATE = struct.Struct('<HQB')
+    MOVE = struct.Struct('<BB')
+    NONE = 0x1F
+    NO_PIECE = 0x10
+    PLAYER = 0x20
+    ANNOUNCED = 0x40
+    QUARTO = 0x80
+
+    def encodestate(self, state):
+        board = state.board
+        squares = 0
+        for pos, piece in enumerate(board.squares):
+            if piece != -1:
+                squares |= piece << 4 * pos
+        flags = board.piece if board.piece != -1 else self.NO_PIECE
+        if state.currentplayer:
+            flags |= self.PLAYER
+        if state._state['visible']['quartoAnnounced']:
+            flags |= self.ANNOUNCED
+        return self.STATE.pack(board.occupied, squares, flags)
+
+    def decodestate(self, stateclass, data):
+        occupied, squares, flags = self.STATE.unpack(data)
+        placed = [squares >> 4 * pos & 0xF if occupied >> pos & 1 else -1 for pos in range(bitboard.NB_SQUARES)]
+        remaining = [p for p in range(bitboard.NB_PIECES) if p not in placed]
+        piece = flags & self.NONE
+        visible = {
+            'board': [bitboard.PIECES[p] if p != -1 else None for p in placed],
+            'remainingPieces': [bitboard.PIECES[p] for p in remaining],
+            'pieceToPlay': remaining.index(piece) if piece != self.NO_PIECE else None,
+            'quartoAnnounced': bool(flags & self.ANNOUNCED)
+        }
+        return stateclass(visible, currentPlayer=int(bool(flags & self.PLAYER)))
+
+    def encodemove(self, move):
+        pos = move.get('pos', self.NONE)
+        nextPiece = move.get('nextPiece', self.NONE)
+        return self.MOVE.pack(pos, nextPiece | (self.QUARTO if move.get('quarto') else 0))
+
+    def decodemove(self, data):
+        if len(data) != self.MOVE.size:
+            raise game.InvalidMoveException('A valid move must be {} bytes long'.format(self.MOVE.size))
+        pos, nextPiece = self.MOVE.unpack(data)
+        move = {}
+        if pos != self.NONE:
+            move['pos'] = pos
+        if nextPiece & self.NONE != self.NONE:
+            move['nextPiece'] = nextPiece & self.NONE
+        if nextPiece & self.QUARTO:
+            move['quarto'] = True
+        return move
 
-class QuartoServer(game.GameServer):
-    '''Class representing a server for the Quarto game.'''
-    def __init__(self, verbose=False):
-        super().__init__('Quarto', 2, QuartoState(), verbose=verbose)
 
-    def applymove(self, move):
-        try:
-            move = json.loads(move)
-        except:
-            raise game.InvalidMoveException('A valid move must be a valid JSON string')
-        else:
-            self._state.applymove(move)
+QUARTO_CODEC = QuartoCodec()
 
 
-class QuartoClient(game.GameClient):
-    '''Class representing a client for the Quarto game.'''
-    def __init__(self, name, server, verbose=False):
-        super().__init__(server, QuartoState, verbose=verbose)
-        self.__name = name
-
-    def _handle(self, message):
-        pass
+class QuartoServer(game.GameServer):
+    '''Class representing a server for the Quarto game.'''
+    def __init__(self, verbose=False, host=game.DEFAULT_HOST, port=game.DEFAULT_PORT, timecontrol=None, log=None):
+        super().__init__('Quarto', 2, QuartoState(), verbose=verbose, host=host, port=port, timecontrol=timecontrol)
+        # Optional gamelog.GameLogWriter recording the finished game
+        self.__log = log
+        self.__first = self._state.currentplayer
+        self.__moves = []
 
-    def _nextmove(self, state):
+    def applymove(self, move):
+        # The binary codec already decodes the moves
+        if isinstance(move, str):
+            try:
+                move = json.loads(move)
+            except:
+                raise game.InvalidMoveException('A valid move must be a valid JSON string')
+        self.__moves.append(self._state.applymove(move))
+
+    def _finished(self, winner):
+        if self.__log is not None:
+            self.__log.append(
+                self.started, self.duration, self.thinking, self.__first, winner,
+                gamelog.FORFEIT if self.forfeited else 0, self.invalid, self.__moves
+            )
+
+
+# Share of the time left given to a search, the rest covers the network
+TIME_MARGIN = 0.8
+
+
+class QuartoPlayer:
+    '''Class choosing the moves of a Quarto player, with or without a server.'''
+    def __init__(self, engine=None, endgame=None, book=None):
+        self.__engine = engine
+        self.__endgame = endgame
+        self.__book = book
+
+    @property
+    def engine(self):
+        '''Search engine choosing the moves, None for the one-ply heuristic.'''
+        return self.__engine
+
+    @property
+    def endgame(self):
+        '''Exact solver taking over below its empty-square threshold, or None.'''
+        return self.__endgame
+
+    @property
+    def book(self):
+        '''Opening book played from while it knows the position, or None.'''
+        return self.__book
+
+    def nextmove(self, state, timeleft=None):
+        '''Return the move to play in 'state', in its JSON-ready form.
+        'timeleft' is the (move, game) time left in seconds announced by the
+        server, if any, and caps the time of the solver and of the search
+        engine.'''
+        start = time.monotonic()
         visible = state._state['visible']
-        move = {}
-
-        # select the position were we'll put the piece given by the opponent
-        if visible['pieceToPlay'] is not None:
-            if self.nextPosition(state):
-                self.nextPosition(state)
-            else :
-                move['pos'] = random.randint(0,15)
+        budget = self._budget(state, timeleft) if timeleft is not None else None
+        bookmove = self.__book.lookup(state.board) if self.__book is not None else None
+
+        move = None
+        if bookmove is not None:
+            # the position is in the opening book
+            move = state.wiremove(*bookmove)
+        elif self.__endgame is not None and visible['pieceToPlay'] is not None and self.__endgame.accepts(state.board):
+            # few empty squares are left: play a perfect move, unless the
+            # solver ran out of time without proving a win, keeping half of
+            # the time for the engine then
+            timelimit = budget
+            if self.__engine is not None:
+                timelimit = (budget if budget is not None else self.__engine.timelimit) / 2
+            solution = self._search(self.__endgame, state.board, timelimit)
+            if solution.complete or solution.result == endgame.WIN:
+                move = state.wiremove(*solution.move)
+
+        if move is None and self.__engine is not None:
+            # let the search engine choose the position and the next piece,
+            # in the time left by the solver
+            engine = self.__engine
+            timelimit = budget if budget is not None else engine.timelimit
+            timelimit = max(timelimit - (time.monotonic() - start), 0.0)
+            move = state.wiremove(*self._search(engine, state.board, timelimit).move)
+        elif move is None:
+            move = {}
+
+            # select the position were we'll put the piece given by the opponent
+            if visible['pieceToPlay'] is not None:
+                move['pos'] = self.nextPosition(state)
+
+            # select the next piece we'll give to the opponent
+            nextPiece = self.nextPieceToGive(state, move.get('pos', -1))
+            if nextPiece is not None:
+                move['nextPiece'] = nextPiece
+
+        # check the move for a quarto without applying it
+        # checkmove will raise if we announce a quarto while there is not
+        try:
+            state.checkmove(dict(move, quarto=True))
+            move['quarto'] = True
+        except game.InvalidMoveException:
+            pass
 
-        # select the next piece we'll give to the opponent
-        self.nextPieceToGive(state)
+        return move
 
-        # apply the move to check for quarto
-        # applymove will raise if we announce a quarto while there is not
-        move['quarto'] = True
+    def _search(self, searcher, board, timelimit):
+        # Search 'board' with the time limit of 'searcher' capped to 'timelimit'
+        saved = searcher.timelimit
+        if timelimit is not None:
+            searcher.timelimit = timelimit if saved is None else min(saved, timelimit)
         try:
-            state.applymove(move)
-        except:
-            del(move['quarto'])
+            return searcher.search(board)
+        finally:
+            searcher.timelimit = saved
 
-        # send the move
-        return json.dumps(move)
+    def _budget(self, state, timeleft):
+        # Spread the game clock over the moves left to this player
+        movetime, clock = timeleft
+        empty = bitboard.NB_SQUARES - bin(state.board.occupied).count('1')
+        return TIME_MARGIN * min(movetime, clock / (empty // 2 + 1))
 
     def nextPosition(self,state) :
         """
         Select the position were we'll put the piece given by the opponent to make
         a quarto. If no quarto is possible then juste put it randomly.
 
-        For each parameter of the piece to place we check if there's not already
-        3 pieces with a commun parameter to place the piece at the remaining spot.
-        If two places can make us win, because we only store one position in
-        move['pos'] we may not have an issue. Also, no try except statement there
-        because we do not apply(move).
+        The threat index of the board gives the squares where the piece completes
+        a line of 3 pieces sharing one of its attributes.
         """
 
-        visible = state._state['visible']
-        move = {}
-        countH,countV,countD1,countD2 = 0
-
-        #low case
-        patternLow = r'[\[\(]{1}.{2}[\]\)]{1}'
-        pLow = re.compile(patternLow)
-        if  bool(pLow.match(visible['pieceToPlay'])) :
-            #No need to check were we can put the piece if there's no quarto possible
-            if self.threeLow :
-                for i in range(4) :
-                #Horizontal check
-                    for h in range(4):
-                        if bool(pLow.match(board[4*i + h])) :
-                            countH+=1
-                        elif countH == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 4*i+h
-
-                #Vertical check
-                    for v in range(4):
-                        if bool(pLow.match(board[4*v + i])) :
-                            countV+=1
-                        elif countV == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =4*v+i
-
-                #First diagonal check
-                    for D1 in range(4):
-                        if bool(pLow.match(board[5 * D1])) :
-                            countD1+=1
-                        elif countD1 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =5*D1
-                #Second diagonal check
-                    for D2 in range(4):
-                        if bool(pLow.match(board[3 + 3*D2])) :
-                            countD2+=1
-                        elif countD2 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 3 + 3*D2
-
-        #High case
-        patternHigh = r'[\[\(]{2}.{2}[\]\)]{2}'
-        pHigh = re.compile(pattern)
-        if  bool(pHigh.match(visible['pieceToPlay'])):
-            if self.threeHigh :
-                for i in range(4) :
-                #Horizontal check
-                    for h in range(4):
-                        if bool(pHigh.match(board[4*i + h])) :
-                            countH+=1
-                        elif countH == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 4*i+h
-
-                #Vertical check
-                    for v in range(4):
-                        if bool(pHigh.match(board[4*v + i])) :
-                            countV+=1
-                        elif countV == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =4*v+i
-
-                #First diagonal check
-                    for D1 in range(4):
-                        if bool(pHigh.match(board[5 * D1])) :
-                            countD1+=1
-                        elif countD1 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =5*D1
-
-                #Second diagonal check
-                    for D2 in range(4):
-                        if bool(pHigh.match(board[3 + 3*D2])) :
-                            countD2+=1
-                        elif countD2 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 3 + 3*D2
-
-        #Light case
-        if  bool(re.search("L",visible['pieceToPlay'])) :
-            if self.threeLight :
-                for i in range(4) :
-                #Horizontal check
-                    for h in range(4):
-                        if bool(re.search("L", board[4*i + h])) :
-                            countH+=1
-                        elif countH == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 4*i+h
-
-                #Vertical check
-                    for v in range(4):
-                        if bool(re.search("L", board[4*v + i])) :
-                            countV+=1
-                        elif countV == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =4*v+i
-
-                #First diagonal check
-                    for D1 in range(4):
-                        if bool(re.search("L", board[5 * D1])) :
-                            countD1+=1
-                        elif countD1 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =5*D1
-
-                #Second diagonal check
-                    for D2 in range(4):
-                        if bool(re.search("L", board[3 + 3*D2])) :
-                            countD2+=1
-                        elif countD2 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 3 + 3*D2
-
-        #Dark case
-        if  bool(re.search("D",visible['pieceToPlay'])) :
-            if self.threeDark :
-                for i in range(4) :
-                #Horizontal check
-                    for h in range(4):
-                        if bool(re.search("D", board[4*i + h])) :
-                            countH+=1
-                        elif countH == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 4*i+h
-
-                #Vertical check
-                    for v in range(4):
-                        if bool(re.search("D", board[4*v + i])) :
-                            countV+=1
-                        elif countV == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =4*v+i
-
-                #First diagonal check
-                    for D1 in range(4):
-                        if bool(re.search("D", board[5 * D1])) :
-                            countD1+=1
-                        elif countD1 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =5*D1
-
-                #Second diagonal check
-                    for D2 in range(4):
-                        if bool(re.search("D", board[3 + 3*D2])) :
-                            countD2+=1
-                        elif countD2 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 3 + 3*D2
-
-        #Full case
-        if  bool(re.search("F",visible['pieceToPlay'])) :
-            if self.threeFull :
-                for i in range(4) :
-                #Horizontal check
-                    for h in range(4):
-                        if bool(re.search("F", board[4*i + h])) :
-                            countH+=1
-                        elif countH == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 4*i+h
-
-                #Vertical check
-                    for v in range(4):
-                        if bool(re.search("F", board[4*v + i])) :
-                            countV+=1
-                        elif countV == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =4*v+i
-
-                #First diagonal check
-                    for D1 in range(4):
-                        if bool(re.search("F", board[5 * D1])) :
-                            countD1+=1
-                        elif countD1 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =5*D1
-
-                #Second diagonal check
-                    for D2 in range(4):
-                        if bool(re.search("F", board[3 + 3*D2])) :
-                            countD2+=1
-                        elif countD2 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 3 + 3*D2
-
-        #Empty case
-        if  bool(re.search("E",visible['pieceToPlay'])) :
-            if self.threeEmpty :
-                for i in range(4) :
-                #Horizontal check
-                    for h in range(4):
-                        if bool(re.search("E", board[4*i + h])) :
-                            countH+=1
-                        elif countH == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 4*i+h
-
-                #Vertical check
-                    for v in range(4):
-                        if bool(re.search("E", board[4*v + i])) :
-                            countV+=1
-                        elif countV == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =4*v+i
-
-                #First diagonal check
-                    for D1 in range(4):
-                        if bool(re.search("E", board[5 * D1])) :
-                            countD1+=1
-                        elif countD1 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =5*D1
-
-                #Second diagonal check
-                    for D2 in range(4):
-                        if bool(re.search("E", board[3 + 3*D2])) :
-                            countD2+=1
-                        elif countD2 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 3 + 3*D2
-
-        #Round case
-        if  bool(re.search("\(",visible['pieceToPlay'])) :
-            if self.threeRound :
-                for i in range(4) :
-                #Horizontal check
-                    for h in range(4):
-                        if bool(re.search("\(", board[4*i + h])) :
-                            countH+=1
-                        elif countH == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 4*i+h
-
-                #Vertical check
-                    for v in range(4):
-                        if bool(re.search("\(", board[4*v + i])) :
-                            countV+=1
-                        elif countV == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =4*v+i
-
-                #First diagonal check
-                    for D1 in range(4):
-                        if bool(re.search("\(", board[5 * D1])) :
-                            countD1+=1
-                        elif countD1 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =5*D1
-
-                #Second diagonal check
-                    for D2 in range(4):
-                        if bool(re.search("\(", board[3 + 3*D2])) :
-                            countD2+=1
-                        elif countD2 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 3 + 3*D2
-
-        #Square case
-        if  bool(re.search("\[",visible['pieceToPlay'])) :
-            if self.threeSquare :
-                for i in range(4) :
-                #Horizontal check
-                    for h in range(4):
-                        if bool(re.search("\[", board[4*i + h])) :
-                            countH+=1
-                        elif countH == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 4*i+h
-
-                #Vertical check
-                    for v in range(4):
-                        if bool(re.search("\[", board[4*v + i])) :
-                            countV+=1
-                        elif countV == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =4*v+i
-
-                #First diagonal check
-                    for D1 in range(4):
-                        if bool(re.search("\[", board[5 * D1])) :
-                            countD1+=1
-                        elif countD1 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot =5*D1
-
-                #Second diagonal check
-                    for D2 in range(4):
-                        if bool(re.search("\[", board[3 + 3*D2])) :
-                            countD2+=1
-                        elif countD2 == 3 :
-                            move['pos'] = visible['board'].index(emptySpot)
-                        else :
-                            emptySpot = 3 + 3*D2
-
-        if len(move['pos']) != 0 :
-            return True, move['pos']
-        else :
-            return False
-
-    def nextPieceToGive(self,state) :
+        board = state.board
+        winning = board.winningsquares(board.piece)
+        if winning :
+            return (winning & -winning).bit_length() - 1
+        return random.choice([pos for pos in range(16) if board.isfree(pos)])
+
+    def nextPieceToGive(self, state, pos=-1) :
         """
-        Function that decides which play we have to give the opponent.
-        The strategy is to check if there's already 3 pieces ready to make a
-        quarto so we don't give the last one.
-        It's a def strategy.
+        Function that decides which piece we have to give the opponent once our
+        piece is on 'pos', as its index in the remaining pieces (None if there
+        is no piece left).
+        The strategy is to only give a piece which cannot complete a line of 3
+        pieces, using the safe pieces of the board. If there's no more safe
+        piece, you've lost anyway so give a random one.
         """
 
-        visible = state._state['visible']
-        move = {}
-        save = visible['remainingPieces']
-
-        if self.threeLow:
-            pattern = r'[\[\(]{1}.{2}[\]\)]{1}'
-            p = re.compile(pattern)
-
-            for elem in save :
-                if bool(p.match(elem)):
-                    save.remove(elem)
-        if self.threeHigh:
-            pattern = r'[\[\(]{2}.{2}[\]\)]{2}'
-            p = re.compile(pattern)
-            for elem in save :
-                if bool(p.match(elem)) :
-                    save.remove(elem)
-        if self.threeEmpty:
-            for elem in save :
-                if  bool(re.search("E", elem)):
-                    save.remove(elem)
-        if self.threeFull :
-            for elem in save :
-                if  bool(re.search("F", elem)):
-                    save.remove(elem)
-        if self.threeDark :
-            for elem in save :
-                if  bool(re.search("D", elem)):
-                    save.remove(elem)
-        if self.threeLight :
-            for elem in save :
-                if  bool(re.search("L", elem)):
-                    save.remove(elem)
-        if self.threeRound :
-            for elem in save :
-                if  bool(re.search("\(", elem)):
-                    save.remove(elem)
-        if self.threeSquare :
-            for elem in save :
-                if  bool(re.search("\[", elem)):
-                    save.remove(elem)
-        try :
-            #give the opponent a piece which will not let him win
-            #doesn't work like intended because it gives the index of the piece in
-            #the save variable, and we want to say "a random piece which is in save"
-            move['nextPiece'] = random.randint(0, len(save) - 1)
-
-        except :
-            #in the case that there's no more safe play, you've lost anyway so give a random piece
-            move['nextPiece'] = random.randint(0, len(visible['remainingPieces']) - 1)
-        return move
+        board = state.board
+        board.push(pos, -1)
+        remaining = board.remaining
+        safe = board.safepieces()
+        board.pop()
+        if not remaining :
+            return None
+        piece = random.choice(bitboard.piecelist(safe or remaining))
+        return bitboard.piecelist(remaining).index(piece)
+
+
+class QuartoClient(game.GameClient):
+    '''Class representing a client for the Quarto game.'''
+    def __init__(self, name, server, verbose=False, engine=None, endgame=None, book=None, codecs=None):
+        # The player must be known before the game loop starts
+        self.__player = QuartoPlayer(engine, endgame, book)
+        self.__name = name
+        super().__init__(server, QuartoState, verbose=verbose, codecs=codecs)
+
+    @property
+    def player(self):
+        return self.__player
+
+    def _handle(self, message):
+        pass
+
+    def _nextmove(self, state):
+        # send the move, encoded by the negotiated codec
+        return self.__player.nextmove(state, self._timeleft)
+
+
+def makeplayer(engine='heuristic', movetime=1.0, endgamethreshold=endgame.DEFAULT_THRESHOLD, hashsize=transposition.DEFAULT_MEGABYTES, workers=None, bookpath=None):
+    '''Build a QuartoPlayer from its command line configuration.'''
+    searcher = None
+    if engine == 'alphabeta':
+        searcher = search.Searcher(timelimit=movetime, table=transposition.TranspositionTable(hashsize))
+    elif engine == 'mcts':
+        searcher = mcts.MonteCarloSearcher(timelimit=movetime, workers=workers)
+    elif engine != 'heuristic':
+        raise ValueError('Unknown engine: {}'.format(engine))
+    solver = endgame.EndgameSolver(threshold=endgamethreshold, timelimit=movetime) if endgamethreshold > 0 else None
+    openingbook = book.OpeningBook(bookpath) if bookpath is not None else None
+    return QuartoPlayer(searcher, solver, openingbook)
+
+
+def buildbook(path, plies, movetime, hashsize=transposition.DEFAULT_MEGABYTES):
+    '''Search the openings of at most 'plies' moves and write the book to 'path'.'''
+    searcher = search.Searcher(timelimit=movetime, table=transposition.TranspositionTable(hashsize))
+    start = time.perf_counter()
+
+    def progress(done, total):
+        if done % 100 == 0 or done == total:
+            print(' {}/{} positions searched ({:.0f}s)'.format(done, total, time.perf_counter() - start))
+
+    count = book.build(path, plies, searcher, progress)
+    print(' {} positions written to {}'.format(count, path))
+
+
+# Players of the self-play games, built once per process
+_selfplayers = {}
+
+def _selfplaygame(configs, first):
+    '''Play a game between two player configurations, without any socket.'''
+    players = []
+    for config in configs:
+        if config not in _selfplayers:
+            _selfplayers[config] = makeplayer(*config)
+        players.append(_selfplayers[config])
+    state = QuartoState(currentPlayer=first)
+    moves = [0, 0]
+    thinking = [0.0, 0.0]
+    invalid = 0
+    winner = -1
+    # Same turn rules as GameServer._gameloop
+    while winner == -1:
+        current = state.currentplayer
+        start = time.perf_counter()
+        move = players[current].nextmove(state)
+        thinking[current] += time.perf_counter() - start
+        moves[current] += 1
+        try:
+            state.applymove(move)
+        except game.InvalidMoveException:
+            invalid += 1
+        winner = state.winner()
+        state.nextPlayer()
+    return winner, moves, thinking, invalid
+
+
+def selfplay(configs, games, workers=None):
+    '''Play 'games' games between two player configurations (makeplayer()
+    arguments), alternating the first player, over a pool of processes.
+
+    Pre: -
+    Post: The returned dictionary holds the aggregated statistics.
+    '''
+    start = time.perf_counter()
+    firsts = [i % 2 for i in range(games)]
+    if workers == 1:
+        results = list(map(_selfplaygame, repeat(configs), firsts))
+    else:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, games // (4 * workers))
+            results = list(pool.map(_selfplaygame, repeat(configs), firsts, chunksize=chunksize))
+    elapsed = time.perf_counter() - start
+
+    stats = {'games': games, 'elapsed': elapsed, 'wins': [0, 0], 'draws': 0, 'moves': [0, 0], 'thinking': [0.0, 0.0], 'invalid': 0}
+    for winner, moves, thinking, invalid in results:
+        if winner is None:
+            stats['draws'] += 1
+        else:
+            stats['wins'][winner] += 1
+        for i in range(2):
+            stats['moves'][i] += moves[i]
+            stats['thinking'][i] += thinking[i]
+        stats['invalid'] += invalid
+    return stats
+
+
+def _printselfplay(names, stats):
+    games = stats['games']
+    game._printsection('Self-play results')
+    print(' {} games in {:.2f}s ({:.1f} games/s)'.format(games, stats['elapsed'], games / stats['elapsed']))
+    for i in range(2):
+        moves = stats['moves'][i]
+        print(' Player {} ({}): {:.1%} wins, {:.2f} ms per move'.format(
+            i, names[i], stats['wins'][i] / games, 1000 * stats['thinking'][i] / moves if moves else 0.0
+        ))
+    print(' Draws: {:.1%}'.format(stats['draws'] / games))
+    print(' Average game length: {:.2f} moves'.format((sum(stats['moves']) - stats['invalid']) / games))
+    if stats['invalid']:
+        print(' Invalid moves: {}'.format(stats['invalid']))
+
+
+def _printanalysis(stats):
+    games = stats['games']
+    game._printsection('Game log analysis')
+    if games == 0:
+        print(' No game recorded.')
+        return
+    print(' {} games, {} ended by a player out of time'.format(games, stats['forfeits']))
+    print(' First player: {:.1%} wins, second player: {:.1%} wins, draws: {:.1%}'.format(
+        stats['firstwins'] / games, stats['secondwins'] / games, stats['draws'] / games
+    ))
+    for key, title in (('square', 'Opening square'), ('piece', 'First given piece')):
+        print()
+        print(' {:>17}  {:>9}  {:>9}  {:>9}'.format(title, 'games', 'first', 'second'))
+        counts, firstwins, secondwins = stats[key]
+        for value in range(len(counts)):
+            if counts[value]:
+                print(' {:>17}  {:>9}  {:>9.1%}  {:>9.1%}'.format(
+                    value, counts[value], firstwins[value] / counts[value], secondwins[value] / counts[value]
+                ))
+    print()
+    print(' {:>17}  {:>9}  {:>9}'.format('Placements', 'positions', 'no safe'))
+    for ply in range(1, len(stats['positions'])):
+        positions = stats['positions'][ply]
+        if positions:
+            print(' {:>17}  {:>9}  {:>9.1%}'.format(ply, positions, stats['unsafe'][ply] / positions))
+    print()
+    print(' {:>17}  {:>9}  {:>9}'.format('Game length', 'games', 'share'))
+    for length, count in enumerate(stats['length']):
+        if count:
+            print(' {:>17}  {:>9}  {:>9.1%}'.format(length, count, count / games))
+
+
+def _parseplayer(spec):
+    # ENGINE[:MOVETIME], e.g. 'alphabeta:0.05'
+    engine, _, movetime = spec.partition(':')
+    return engine, float(movetime) if movetime else 1.0
 
-    def threeLow(self):
-        #function that checks if 3 Low pieces are about to make a quarto
-        #Return : True if yes
-        #         False otherwise
-        pattern = r'[\[\(]{1}.{2}[\]\)]{1}'
-        p = re.compile(pattern)
-        countH,countV,countD1,countD2 = 0
-        for i in range(4) :
-        #Horizontal check
-            for h in range(4):
-                if bool(p.match(board[4*i + h])) :
-                    countH+=1
-        #Vertical check
-            for v in range(4):
-                if bool(p.match(board[4*v + i])) :
-                    countV+=1
-        #First diagonal check
-            for D1 in range(4):
-                if bool(p.match(board[5 * D1])) :
-                    countD1+=1
-        #Second diagonal check
-            for D2 in range(4):
-                if bool(p.match(board[3 + 3*D2])) :
-                    countD2+=1
-
-        if countH or countV or countD1 or countD2 == 3 :
-            return True
-        else :
-            return False
-
-    def threeHigh(self):
-        #function that checks if 3 High pieces are about to make a quarto
-        #Return : True if yes
-        #         False otherwise
-
-        pattern = r'[\[\(]{2}.{2}[\]\)]{2}'
-        p = re.compile(pattern)
-        countH,countV,countD1,countD2 = 0
-        for i in range(4) :
-        #Horizontal check
-            for h in range(4):
-                if bool(p.match(board[4*i + h])) :
-                    countH+=1
-        #Vertical check
-            for v in range(4):
-                if bool(p.match(board[4*v + i])) :
-                    countV+=1
-        #First diagonal check
-            for D1 in range(4):
-                if bool(p.match(board[5 * D1])) :
-                    countD1+=1
-        #Second diagonal check
-            for D2 in range(4):
-                if bool(p.match(board[3 + 3*D2])) :
-                    countD2+=1
-
-        if countH or countV or countD1 or countD2 == 3 :
-            return True
-        else :
-            return False
-
-    def threeLight(self):
-        #function that checks if 3 light pieces are about to make a quarto
-        #Return : True if yes
-        #         False otherwise
-
-        countH,countV,countD1,countD2 = 0
-        for i in range(4) :
-        #Horizontal check
-            for h in range(4):
-                if bool(re.search("L", board[4*i + h])) :
-                    countH+=1
-        #Vertical check
-            for v in range(4):
-                if bool(re.search("L", board[4*v + i])):
-                    countV+=1
-        #First diagonal check
-            for D1 in range(4):
-                if bool(re.search("L", board[5 * D1])) :
-                    countD1+=1
-        #Second diagonal check
-            for D2 in range(4):
-                if bool(re.search("L", board[3 + 3*D2])) :
-                    countD2+=1
-
-        if countH or countV or countD1 or countD2 == 3 :
-            return True
-        else :
-            return False
-
-    def threeDark(self):
-        #function that checks if 3 Dark pieces are about to make a quarto
-        #Return : True if yes
-        #         False otherwise
-
-        countH,countV,countD1,countD2 = 0
-        for i in range(4) :
-        #Horizontal check
-            for h in range(4):
-                if bool(re.search("D", board[4*i + h])) :
-                    countH+=1
-        #Vertical check
-            for v in range(4):
-                if bool(re.search("D", board[4*v + i])):
-                    countV+=1
-        #First diagonal check
-            for D1 in range(4):
-                if bool(re.search("D", board[5 * D1])) :
-                    countD1+=1
-        #Second diagonal check
-            for D2 in range(4):
-                if bool(re.search("D", board[3 + 3*D2])) :
-                    countD2+=1
-
-        if countH or countV or countD1 or countD2 == 3 :
-            return True
-        else :
-            return False
-
-    def threeFull(self):
-        #function that checks if 3 Fullfilled pieces are about to make a quarto
-        #Return : True if yes
-        #         False otherwise
-
-        countH,countV,countD1,countD2 = 0
-        for i in range(4) :
-        #Horizontal check
-            for h in range(4):
-                if bool(re.search("F", board[4*i + h])) :
-                    countH+=1
-        #Vertical check
-            for v in range(4):
-                if bool(re.search("F", board[4*v + i])):
-                    countV+=1
-        #First diagonal check
-            for D1 in range(4):
-                if bool(re.search("F", board[5 * D1])) :
-                    countD1+=1
-        #Second diagonal check
-            for D2 in range(4):
-                if bool(re.search("F", board[3 + 3*D2])) :
-                    countD2+=1
-
-        if countH or countV or countD1 or countD2 == 3 :
-            return True
-        else :
-            return False
-
-    def threeEmpty(self):
-        #function that checks if 3 Empty pieces are about to make a quarto
-        #Return : True if yes
-        #         False otherwise
-
-        countH,countV,countD1,countD2 = 0
-        for i in range(4) :
-        #Horizontal check
-            for h in range(4):
-                if bool(re.search("E", board[4*i + h])) :
-                    countH+=1
-        #Vertical check
-            for v in range(4):
-                if bool(re.search("E", board[4*v + i])):
-                    countV+=1
-        #First diagonal check
-            for D1 in range(4):
-                if bool(re.search("E", board[5 * D1])) :
-                    countD1+=1
-        #Second diagonal check
-            for D2 in range(4):
-                if bool(re.search("E", board[3 + 3*D2])) :
-                    countD2+=1
-
-        if countH or countV or countD1 or countD2 == 3 :
-            return True
-        else :
-            return False
-
-    def threeRound(self):
-        #function that checks if 3 Round shaped pieces are about to make a quarto
-        #Return : True if yes
-        #         False otherwise
-
-        countH,countV,countD1,countD2 = 0
-        for i in range(4) :
-        #Horizontal check
-            for h in range(4):
-                if bool(re.search("\(", board[4*i + h])) :
-                    countH+=1
-        #Vertical check
-            for v in range(4):
-                if bool(re.search("\(", board[4*v + i])):
-                    countV+=1
-        #First diagonal check
-            for D1 in range(4):
-                if bool(re.search("\(", board[5 * D1])) :
-                    countD1+=1
-        #Second diagonal check
-            for D2 in range(4):
-                if bool(re.search("\(", board[3 + 3*D2])) :
-                    countD2+=1
-
-        if countH or countV or countD1 or countD2 == 3 :
-            return True
-        else :
-            return False
-
-    def threeSquare(self):
-        #function that checks if 3 Square shaped pieces are about to make a quarto
-        #Return : True if yes
-        #         False otherwise
-
-        countH,countV,countD1,countD2 = 0
-        for i in range(4) :
-        #Horizontal check
-            for h in range(4):
-                if bool(re.search("\[", board[4*i + h])) :
-                    countH+=1
-        #Vertical check
-            for v in range(4):
-                if bool(re.search("\[", board[4*v + i])):
-                    countV+=1
-        #First diagonal check
-            for D1 in range(4):
-                if bool(re.search("\[", board[5 * D1])) :
-                    countD1+=1
-        #Second diagonal check
-            for D2 in range(4):
-                if bool(re.search("\[", board[3 + 3*D2])) :
-                    countD2+=1
-
-        if countH or countV or countD1 or countD2 == 3 :
-            return True
-        else :
-            return False
 
 if __name__ == '__main__':
     # Create the top-level parser
     parser = argparse.ArgumentParser(description='Quarto game')
-    subparsers = parser.add_subparsers(description='server client', help='Quarto game components', dest='component')
+    subparsers = parser.add_subparsers(description='server client selfplay book analyze', help='Quarto game components', dest='component')
     # Create the parser for the 'server' subcommand
     server_parser = subparsers.add_parser('server', help='launch a server')
-    server_parser.add_argument('--host', help='hostname (default: localhost)', default='localhost')
-    server_parser.add_argument('--port', help='port to listen on (default: 5000)', default=5000)
+    server_parser.add_argument('--host', help='address to listen on (default: {})'.format(game.DEFAULT_HOST), default=game.DEFAULT_HOST)
+    server_parser.add_argument('--port', help='port to listen on (default: {})'.format(game.DEFAULT_PORT), type=int, default=game.DEFAULT_PORT)
     server_parser.add_argument('--verbose', action='store_true')
+    server_parser.add_argument('--lobby', help='serve concurrent games, pairing the clients as they connect', action='store_true')
+    server_parser.add_argument('--games', help='number of games served by the lobby before it stops (default: no limit)', type=int, default=None)
+    server_parser.add_argument('--movetime', help='time allowed per move in seconds (default: no limit)', type=float, default=None)
+    server_parser.add_argument('--gametime', help='time allowed to each player for the whole game in seconds (default: no limit)', type=float, default=None)
+    server_parser.add_argument('--gamelog', help='binary log file the finished games are appended to (default: none)', default=None)
+    server_parser.add_argument('--metrics', help='port of the HTTP endpoint serving the metrics on /metrics (default: disabled)', type=int, default=None)
+    server_parser.add_argument('--grace', help='extra time tolerated per move for the network in seconds (default: 0.1)', type=float, default=0.1)
     # Create the parser for the 'client' subcommand
     client_parser = subparsers.add_parser('client', help='launch a client')
     client_parser.add_argument('name', help='name of the player')
     client_parser.add_argument('--host', help='hostname of the server (default: localhost)', default='127.0.0.1')
-    client_parser.add_argument('--port', help='port of the server (default: 5000)', default=5000)
+    client_parser.add_argument('--port', help='port of the server (default: 5000)', type=int, default=game.DEFAULT_PORT)
     client_parser.add_argument('--verbose', action='store_true')
+    client_parser.add_argument('--engine', help='move selection (default: heuristic)', choices=['heuristic', 'alphabeta', 'mcts'], default='heuristic')
+    client_parser.add_argument('--movetime', help='search time per move in seconds (default: 1.0)', type=float, default=1.0)
+    client_parser.add_argument('--workers', help='number of processes of the mcts engine (default: number of CPUs)', type=int, default=None)
+    client_parser.add_argument('--endgame', help='number of empty squares from which the game is solved exactly, 0 to disable (default: {})'.format(endgame.DEFAULT_THRESHOLD), type=int, default=endgame.DEFAULT_THRESHOLD)
+    client_parser.add_argument('--hashsize', help='transposition table size in megabytes (default: 16)', type=int, default=transposition.DEFAULT_MEGABYTES)
+    client_parser.add_argument('--book', help='opening book file built with the book subcommand', default=None)
+    client_parser.add_argument('--codec', help='wire encoding offered to the server (default: quarto, falling back to json)', choices=['quarto', 'json'], default='quarto')
+    # Create the parser for the 'selfplay' subcommand
+    selfplay_parser = subparsers.add_parser('selfplay', help='play games between two engines without server')
+    selfplay_parser.add_argument('--player1', help='ENGINE[:MOVETIME] of the first player (default: alphabeta:0.05)', default='alphabeta:0.05')
+    selfplay_parser.add_argument('--player2', help='ENGINE[:MOVETIME] of the second player (default: heuristic)', default='heuristic')
+    selfplay_parser.add_argument('--games', help='number of games (default: 100)', type=int, default=100)
+    selfplay_parser.add_argument('--workers', help='number of processes (default: number of CPUs)', type=int, default=None)
+    selfplay_parser.add_argument('--endgame', help='number of empty squares from which the game is solved exactly, 0 to disable (default: {})'.format(endgame.DEFAULT_THRESHOLD), type=int, default=endgame.DEFAULT_THRESHOLD)
+    selfplay_parser.add_argument('--hashsize', help='transposition table size in megabytes (default: 16)', type=int, default=transposition.DEFAULT_MEGABYTES)
+    selfplay_parser.add_argument('--book', help='opening book file used by both players', default=None)
+    # Create the parser for the 'book' subcommand
+    book_parser = subparsers.add_parser('book', help='build an opening book')
+    book_parser.add_argument('path', help='book file to write')
+    book_parser.add_argument('--plies', help='number of opening moves covered (default: 3)', type=int, default=3)
+    book_parser.add_argument('--movetime', help='search time per position in seconds (default: 1.0)', type=float, default=1.0)
+    book_parser.add_argument('--hashsize', help='transposition table size in megabytes (default: 16)', type=int, default=transposition.DEFAULT_MEGABYTES)
+    # Create the parser for the 'analyze' subcommand
+    analyze_parser = subparsers.add_parser('analyze', help='compute statistics over a game log (requires NumPy)')
+    analyze_parser.add_argument('path', help='game log written by the server')
+    analyze_parser.add_argument('--chunksize', help='number of games processed at once (default: 65536)', type=int, default=1 << 16)
     # Parse the arguments of sys.args
     args = parser.parse_args()
     if args.component == 'server':
-        QuartoServer(verbose=args.verbose).run()
+        if args.metrics is not None:
+            metrics.MetricsServer(port=args.metrics).start()
+        timecontrol = None
+        if args.movetime is not None or args.gametime is not None:
+            timecontrol = game.TimeControl(args.movetime, args.gametime, args.grace)
+        log = gamelog.GameLogWriter(args.gamelog) if args.gamelog is not None else None
+        if args.lobby:
+            factory = lambda: QuartoServer(timecontrol=timecontrol, log=log)
+            game.GameLobby(factory, host=args.host, port=args.port, verbose=args.verbose, games=args.games).run()
+        else:
+            QuartoServer(verbose=args.verbose, host=args.host, port=args.port, timecontrol=timecontrol, log=log).run()
+        if log is not None:
+            log.close()
+    elif args.component == 'selfplay':
+        names = (args.player1, args.player2)
+        # One process per game: the engines themselves run a single process
+        configs = tuple(_parseplayer(name) + (args.endgame, args.hashsize, 1, args.book) for name in names)
+        _printselfplay(names, selfplay(configs, args.games, workers=args.workers))
+    elif args.component == 'book':
+        buildbook(args.path, args.plies, args.movetime, args.hashsize)
+    elif args.component == 'analyze':
+        # NumPy is only needed here
+        from lib import analysis
+        _printanalysis(analysis.analyze(args.path, args.chunksize))
     else:
-        QuartoClient(args.name, (args.host, args.port), verbose=args.verbose)
+        player = makeplayer(args.engine, args.movetime, args.endgame, args.hashsize, args.workers, args.book)
+        QuartoClient(args.name, (args.host, args.port), verbose=args.verbose, engine=player.engine, endgame=player.endgame, book=player.book,
+                     codecs=QuartoState.codecs() if args.codec == 'quarto' else (game.JSON_CODEC,))